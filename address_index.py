@@ -0,0 +1,100 @@
+import bisect
+import heapq
+import os
+
+# In-memory prefix index for /api/suggest. Addresses are kept in one sorted list of
+# normalized strings, so a lookup is a binary search plus a short forward scan and never
+# touches the browser. Each address is also indexed from every word of its street, so
+# "west oak" and "oak st" find "1900 West Oak Street" as well as "1900 w" does.
+
+ADDRESS_LIST_FILE = os.environ.get(
+    "ADDRESS_LIST_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "addresses.txt")
+)
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
+
+def normalize(text):
+    return " ".join(text.lower().replace(",", " ").split())
+
+
+class AddressIndex:
+    def __init__(self):
+        # Sorted (normalized, display) pairs; several normalized forms may point at one display
+        self._entries = []
+        self._known = {}
+        self.lookups = 0
+
+    def __len__(self):
+        return len(self._known)
+
+    def _new_entries(self, display, verified):
+        # Index entries for an address not seen before; an empty list if it adds nothing
+        display = " ".join(display.split())
+        key = normalize(display)
+        if not key:
+            return []
+        if key in self._known:
+            # Upgrading a listed address to verified is the only change worth recording
+            self._known[key] = self._known[key] or verified
+            return []
+        self._known[key] = verified
+        words = key.split()
+        street_words = len(display.split(",")[0].split())
+        return [(form, display) for form in {" ".join(words[i:]) for i in range(max(1, street_words))}]
+
+    def add(self, display, verified=False):
+        # One address at runtime: insort keeps the list sorted without a full re-sort
+        for entry in self._new_entries(display, verified):
+            bisect.insort(self._entries, entry)
+
+    def add_many(self, displays, verified=False):
+        # Bulk load: insort per entry would be quadratic, so collect everything and sort once
+        before = len(self)
+        added = []
+        for display in displays:
+            added += self._new_entries(display, verified)
+        if added:
+            self._entries += added
+            self._entries.sort()
+        return len(self) - before
+
+    def merge(self, other):
+        # Fold in an index built elsewhere (e.g. in a thread at startup) with one linear merge
+        fresh = {key: verified for key, verified in other._known.items() if key not in self._known}
+        for key, verified in other._known.items():
+            if key in self._known:
+                self._known[key] = self._known[key] or verified
+        self._known.update(fresh)
+        added = [entry for entry in other._entries if normalize(entry[1]) in fresh]
+        self._entries = list(heapq.merge(self._entries, added))
+        return len(fresh)
+
+    def load_file(self, path=ADDRESS_LIST_FILE):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lines = [line.strip() for line in f]
+        except OSError:
+            return 0
+        return self.add_many(line for line in lines if line and not line.startswith("#"))
+
+    def suggest(self, query, limit=SUGGEST_LIMIT):
+        self.lookups += 1
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        i = bisect.bisect_left(self._entries, (prefix, ""))
+        while i < len(self._entries) and len(results) < limit:
+            form, display = self._entries[i]
+            if not form.startswith(prefix):
+                break
+            if display not in seen:
+                seen.add(display)
+                results.append({"address": display, "verified": self._known[normalize(display)]})
+            i += 1
+        return results
+
+    def stats(self):
+        return {"addresses": len(self), "index_entries": len(self._entries), "lookups": self.lookups}
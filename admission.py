@@ -0,0 +1,130 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import math
+import os
+import time
+
+from page_pool import PAGE_POOL_SIZE
+
+# Admission control in front of the browser. At most `concurrency` lookups drive
+# Chromium at once; the rest wait in a priority queue (interactive before batch)
+# and are turned away immediately once their class's queue is full.
+
+INTERACTIVE = 0
+BATCH = 1
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+ADMISSION_CONCURRENCY = int(os.environ.get("ADMISSION_CONCURRENCY", str(PAGE_POOL_SIZE)))
+ADMISSION_MAX_QUEUE = int(os.environ.get("ADMISSION_MAX_QUEUE", "50"))
+ADMISSION_MAX_BATCH_QUEUE = int(os.environ.get("ADMISSION_MAX_BATCH_QUEUE", "200"))
+
+
+class QueueFull(Exception):
+    def __init__(self, priority, retry_after):
+        super().__init__(f"{PRIORITY_NAMES[priority]} queue is full")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    def __init__(self, concurrency=ADMISSION_CONCURRENCY, max_queue=ADMISSION_MAX_QUEUE, max_batch_queue=ADMISSION_MAX_BATCH_QUEUE):
+        self.concurrency = concurrency
+        self.max_queue = {INTERACTIVE: max_queue, BATCH: max_batch_queue}
+        self._active = 0
+        # Heap of (priority, seq, future); cancelled waiters are skipped lazily on release
+        self._waiters = []
+        self._seq = itertools.count()
+        self._queued = {INTERACTIVE: 0, BATCH: 0}
+        self.admitted = {INTERACTIVE: 0, BATCH: 0}
+        self.rejected = {INTERACTIVE: 0, BATCH: 0}
+        self.total_wait = {INTERACTIVE: 0.0, BATCH: 0.0}
+        self.max_wait = {INTERACTIVE: 0.0, BATCH: 0.0}
+        # Smoothed time a lookup holds its slot, used to estimate Retry-After
+        self.avg_hold = 5.0
+
+    @property
+    def active(self):
+        return self._active
+
+    def queue_depth(self, priority=None):
+        if priority is None:
+            return sum(self._queued.values())
+        return self._queued[priority]
+
+    def retry_after(self):
+        backlog = self.queue_depth() + self._active
+        return max(1, math.ceil(backlog * self.avg_hold / max(1, self.concurrency)))
+
+    async def acquire(self, priority=INTERACTIVE):
+        start = time.monotonic()
+        if self._active < self.concurrency and not self.queue_depth():
+            self._active += 1
+            self._record_admit(priority, 0.0)
+            return
+
+        if self._queued[priority] >= self.max_queue[priority]:
+            self.rejected[priority] += 1
+            raise QueueFull(priority, self.retry_after())
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._queued[priority] += 1
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # We were handed a slot at the same moment we were cancelled; pass it on
+                self.release()
+            else:
+                self._queued[priority] -= 1
+            raise
+        self._record_admit(priority, time.monotonic() - start)
+
+    def release(self):
+        while self._waiters:
+            priority, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            # Hand our slot straight to the next waiter, so _active is unchanged
+            self._queued[priority] -= 1
+            future.set_result(None)
+            return
+        self._active -= 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority=INTERACTIVE):
+        await self.acquire(priority)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.avg_hold = 0.9 * self.avg_hold + 0.1 * (time.monotonic() - start)
+            self.release()
+
+    def _record_admit(self, priority, waited):
+        self.admitted[priority] += 1
+        self.total_wait[priority] += waited
+        self.max_wait[priority] = max(self.max_wait[priority], waited)
+
+    def stats(self):
+        classes = {}
+        for priority, name in PRIORITY_NAMES.items():
+            admitted = self.admitted[priority]
+            classes[name] = {
+                "queued": self._queued[priority],
+                "max_queue": self.max_queue[priority],
+                "admitted": admitted,
+                "rejected": self.rejected[priority],
+                "avg_wait_seconds": self.total_wait[priority] / admitted if admitted else 0.0,
+                "max_wait_seconds": self.max_wait[priority],
+            }
+        return {
+            "concurrency": self.concurrency,
+            "active": self._active,
+            "queue_depth": self.queue_depth(),
+            "avg_hold_seconds": self.avg_hold,
+            "classes": classes,
+        }
@@ -1,11 +1,47 @@
-from fastapi import FastAPI, HTTPException
+import time
+
+# Taken before the heavier imports below so startup timing covers them too
+PROCESS_STARTED = time.monotonic()
+
+from fastapi import Depends, FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from playwright.async_api import async_playwright
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+import httpx
 import uvicorn
 import asyncio
+import json
+import logging
+import math
 import os
 import re
+from collections import OrderedDict
+
+from smarthub_rpc import SmartHubRpcClient, TokensRejected, SMARTHUB_BASE_URL, TOKEN_FILE
+from page_pool import PoolClosed, PAGE_POOL_SIZE
+from browser_manager import BrowserManager
+from scraper import TokenRefresher
+from smarthub_form import OptionMaps, StepTimings, SubmitFailed, fill_shop_form
+from admission import AdmissionController, QueueFull, INTERACTIVE, BATCH
+from jobs import JobStore, StoreFull, format_sse
+from result_store import ResultStore, AVAILABILITY_DB
+from runtime_paths import VAR_DIR
+from gwt_decoder import DecodeError, GwtException, decode_addresses
+from address_index import AddressIndex, SUGGEST_LIMIT, SUGGEST_MAX_LIMIT
+from rate_limit import RateLimiter
+from circuit_breaker import CircuitBreaker, CIRCUIT_REJECTED, STATE_VALUES
+from static_files import StaticFiles
+from tracing import TRACE_FILE
+from fingerprint_assets import MANIFEST_FILE
+from asset_cache import AssetCache, ASSET_CACHE, ASSET_CACHE_DIR
+import resource_router
+import metrics
+import structured_log
+import tracing
+
+# Log lines are queued and written as JSON from a background thread, tagged with the request's trace id
+structured_log.setup()
+log = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -17,32 +53,371 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global Playwright state for Browser Pool Optimization
-pw = None
-browser = None
+@app.middleware("http")
+async def server_timing(request, call_next):
+    # Every API request is traced; its spans are summed per stage into a Server-Timing header
+    if not request.url.path.startswith("/api/"):
+        return await call_next(request)
+    trace = tracing.start_trace()
+    with tracing.span("request", method=request.method, path=request.url.path) as root:
+        response = await call_next(request)
+    stages = trace.server_timing(exclude=("request",))
+    total = f"total;dur={root.duration_ms:.1f}"
+    response.headers["Server-Timing"] = f"{stages}, {total}" if stages else total
+    response.headers["Timing-Allow-Origin"] = "*"
+    # The same id is on every log line and trace event for this request
+    response.headers["X-Request-Id"] = trace.id
+    return response
+
+# Global Playwright state for Browser Pool Optimization: one Chromium and its page pool,
+# recycled by the manager when it grows too large or dies. It is launched in the background
+# after startup, so it stays None (and browser_ready unset) until the first pool is warm.
+browser_manager = None
+browser_ready = asyncio.Event()
+warmup_task = None
+
+BROWSER_WARMUP_RETRY = float(os.environ.get("BROWSER_WARMUP_RETRY", "15"))
+# How long a lookup that needs the browser waits for warm-up before being turned away
+BROWSER_READY_WAIT = float(os.environ.get("BROWSER_READY_WAIT", "20"))
+
+STARTUP_SECONDS = metrics.Gauge(
+    "peak_startup_seconds",
+    "Seconds from process start to each startup milestone (serving, browser_ready).",
+    ["phase"],
+)
+startup_times = {}
+
+def record_startup(phase):
+    seconds = round(time.monotonic() - PROCESS_STARTED, 3)
+    startup_times[phase] = seconds
+    STARTUP_SECONDS.set(seconds, phase)
+    log.info("Startup: %s after %ss.", phase, seconds, extra={"phase": phase, "seconds": seconds})
+
+# Pooled HTTP client for the direct MemberService fast path, and the task keeping its tokens fresh
+rpc_client = None
+token_refresher = None
+
+STATE_MAPPING = {'OR': 'Oregon', 'WA': 'Washington', 'CA': 'California', 'ID': 'Idaho'}
+
+NOT_VERIFIED_MESSAGE = "SmartHub could not verify this address, or more specific City/State filtering is required."
+NETWORK_ERROR_MESSAGE = "Network error from SmartHub or request timed out"
+SUBMIT_TIMEOUT_MESSAGE = "Submit button not found or network timed out."
+INTERNAL_ERROR_MESSAGE = "An internal error occurred while validating the address."
+UPSTREAM_DOWN_MESSAGE = "SmartHub is temporarily unavailable, please try again in a few minutes."
+
+def lookup_outcome(result):
+    # Buckets a check_availability result into success / not_verified / timeout / error
+    if result.get("status") == "success":
+        return "success"
+    message = result.get("message")
+    if message == NOT_VERIFIED_MESSAGE:
+        return "not_verified"
+    if message in (NETWORK_ERROR_MESSAGE, SUBMIT_TIMEOUT_MESSAGE):
+        return "timeout"
+    return "error"
+
+class AvailabilityCache:
+    # Bounded LRU of lookup results keyed on the normalized (street, city, state) tuple.
+    # Entries are (expires_at, result) tuples so each one costs a single small allocation.
+    # Misses read through to the shared on-disk store, if one is given, before going upstream.
+    def __init__(self, max_entries, positive_ttl, negative_ttl, error_ttl, store=None):
+        self.max_entries = max_entries
+        self.store = store
+        self.ttls = {
+            "success": positive_ttl,
+            "not_verified": negative_ttl,
+            "timeout": error_ttl,
+            "error": error_ttl,
+        }
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remember(self, key, expires_at, result):
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load(self, key):
+        # Pull a row written by any worker into memory, converting its wall-clock expiry
+        stored = self.store.get(key) if self.store else None
+        if stored is None:
+            return None
+        result, expires_at = stored
+        entry = (time.monotonic() + (expires_at - time.time()), result)
+        if self.max_entries > 0:
+            self._remember(key, *entry)
+        return entry
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        from_store = False
+        if entry is None or entry[0] <= time.monotonic():
+            # Another worker may have refreshed it since this one last looked
+            entry = self._load(key) or entry
+            from_store = True
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, result = entry
+        if expires_at <= time.monotonic():
+            # Expired entries stay until evicted so they can still be served stale during an outage
+            self.misses += 1
+            return None
+        if from_store:
+            self.store_hits += 1
+        else:
+            self._entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def get_stale(self, key):
+        # Last answer SmartHub actually gave for this key, however old; errors don't count
+        entry = self._entries.get(key) or self._load(key)
+        if entry is None or lookup_outcome(entry[1]) not in ("success", "not_verified"):
+            return None
+        return entry[1]
+
+    def put(self, key, result):
+        outcome = lookup_outcome(result)
+        ttl = self.ttls[outcome]
+        if ttl <= 0:
+            return
+        if self.store:
+            self.store.put(key, outcome, result, ttl)
+        if self.max_entries > 0:
+            self._remember(key, time.monotonic() + ttl, result)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+class SingleFlight:
+    # Collapses concurrent calls for the same key onto one shared task.
+    # The task is shielded so a caller disconnecting never cancels the lookup for everyone else.
+    def __init__(self):
+        self._inflight = {}
+        self.leaders = 0
+        self.followers = 0
+
+    @property
+    def inflight(self):
+        return len(self._inflight)
+
+    def __contains__(self, key):
+        return key in self._inflight
+
+    async def do(self, key, make_coro):
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(make_coro())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.followers += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+def cache_key(street, city, state):
+    return tuple(" ".join(part.lower().split()) for part in (street, city, state))
+
+# Shared across workers and restarts; the in-memory LRU in front of it saves the SQLite read on hot keys
+result_store = ResultStore()
+
+result_cache = AvailabilityCache(
+    max_entries=int(os.environ.get("AVAILABILITY_CACHE_SIZE", "10000")),
+    positive_ttl=float(os.environ.get("AVAILABILITY_CACHE_POSITIVE_TTL", "86400")),
+    negative_ttl=float(os.environ.get("AVAILABILITY_CACHE_NEGATIVE_TTL", "3600")),
+    error_ttl=float(os.environ.get("AVAILABILITY_CACHE_ERROR_TTL", "30")),
+    store=result_store,
+)
+
+lookup_flight = SingleFlight()
+
+# Known-good addresses for /api/suggest: the optional address list plus everything SmartHub has verified
+address_index = AddressIndex()
+# Loads the address list and verified store keys in a thread after startup
+seed_task = None
+
+# Bounds how many lookups drive Chromium at once; interactive checks jump ahead of batch work
+admission = AdmissionController()
+
+BUSY_MESSAGE = "The availability checker is busy, please try again shortly."
+
+# State/city select values learned from Shop.html, so lookups assign values instead of searching option text
+option_maps = OptionMaps()
+
+# Per-client token buckets per route, so a single client can't monopolize the browser pool
+rate_limiter = RateLimiter()
+
+RATE_LIMITED_MESSAGE = "Too many availability checks from this client, please slow down."
+
+def rate_limited(route):
+    async def check_rate_limit(request: Request):
+        retry_after = rate_limiter.check(route, request)
+        if retry_after:
+            raise HTTPException(
+                status_code=429,
+                detail=RATE_LIMITED_MESSAGE,
+                headers={"Retry-After": str(max(1, round(retry_after + 0.5)))},
+            )
+    return Depends(check_rate_limit)
+
+# Trips when SmartHub keeps failing or slowing down, so lookups stop burning full timeouts
+upstream_breaker = CircuitBreaker()
+
+# Which sub-resources the SmartHub pages may load, and what blocking the rest has saved so far
+routing_policy = resource_router.RoutingPolicy()
+route_totals = {}
+# Static SmartHub files replayed from disk into new pages; only Shop.html and MemberService go upstream
+asset_cache = AssetCache() if ASSET_CACHE else None
+
+# Scrape-time views onto the live objects, exported alongside the counters in metrics.py
+metrics.CallbackMetric("peak_browser_open_pages", "Pages currently open in the shared Chromium.",
+                       lambda: browser_manager.pool.open_pages if browser_manager else 0)
+metrics.CallbackMetric("peak_browser_idle_pages", "Pooled pages waiting for a lookup.",
+                       lambda: browser_manager.pool.idle_pages if browser_manager else 0)
+metrics.CallbackMetric("peak_browser_contexts", "Browser contexts open in the current Chromium.",
+                       lambda: browser_manager.contexts if browser_manager else 0)
+metrics.CallbackMetric("peak_browser_rss_bytes", "Resident memory of the Chromium process tree at the last watchdog sample.",
+                       lambda: browser_manager.last_rss if browser_manager else None)
+metrics.CallbackMetric("peak_browser_lookups_since_launch", "Pages leased from the current Chromium's pool.",
+                       lambda: browser_manager.pool.leases if browser_manager else 0)
+metrics.CallbackMetric("peak_cache_hits_total", "Result cache hits.", lambda: result_cache.hits, kind="counter")
+metrics.CallbackMetric("peak_cache_misses_total", "Result cache misses.", lambda: result_cache.misses, kind="counter")
+metrics.CallbackMetric("peak_cache_store_hits_total", "Result cache hits answered from the shared SQLite store.",
+                       lambda: result_cache.store_hits, kind="counter")
+metrics.CallbackMetric("peak_cache_entries", "Entries in the result cache.", lambda: len(result_cache))
+metrics.CallbackMetric("peak_cache_hit_ratio", "Result cache hits / lookups since start.",
+                       lambda: result_cache.stats()["hit_ratio"])
+metrics.CallbackMetric("peak_inflight_lookups", "Distinct upstream lookups in flight.", lambda: lookup_flight.inflight)
+metrics.CallbackMetric("peak_circuit_state", "SmartHub circuit breaker state (0 closed, 1 half-open, 2 open).",
+                       lambda: STATE_VALUES[upstream_breaker.state])
+metrics.CallbackMetric("peak_asset_cache_hits_total", "SmartHub static files replayed from the asset cache.",
+                       lambda: asset_cache.hits if asset_cache else 0, kind="counter")
+metrics.CallbackMetric("peak_asset_cache_misses_total", "SmartHub static files fetched upstream by the asset cache.",
+                       lambda: asset_cache.misses if asset_cache else 0, kind="counter")
+metrics.CallbackMetric("peak_admission_active", "Lookups currently holding a browser slot.", lambda: admission.active)
+metrics.CallbackMetric("peak_admission_queue_depth", "Lookups waiting for a browser slot.", lambda: admission.queue_depth())
+
+# Batch checks fan out across at most this many concurrent lookups, by default one per pooled page
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", str(PAGE_POOL_SIZE)))
+BATCH_MAX_ADDRESSES = int(os.environ.get("BATCH_MAX_ADDRESSES", "1000"))
+
+class BatchCheckRequest(BaseModel):
+    addresses: list[str]
+
+class JobRequest(BaseModel):
+    address: str
+
+# Asynchronous checks: submit returns a job id straight away, progress is polled or streamed over SSE
+job_store = JobStore()
+job_tasks = set()
 
 @app.on_event("startup")
 async def startup_event():
-    global pw, browser
-    pw = await async_playwright().start()
-    # Keep one headless browser instance running permanently in the background
-    browser = await pw.chromium.launch(headless=True)
-    print("Background browser pool started.")
-    
+    global rpc_client, token_refresher, warmup_task, seed_task
+    record_startup("imported")
+    result_store.start()
+    tracing.exporter.start()
+    if asset_cache:
+        asset_cache.load()
+    seed_task = asyncio.create_task(seed_address_index())
+    rpc_client = SmartHubRpcClient()
+    await rpc_client.start()
+    # Scrapes are skipped until a browser exists; stored tokens still load straight away
+    token_refresher = TokenRefresher(rpc_client, lambda: browser_manager.browser if browser_manager else None)
+    token_refresher.start()
+    # Chromium comes up in the background so the site and the rpc fast path serve immediately
+    warmup_task = asyncio.create_task(warm_up_browser())
+    record_startup("serving")
+
+def build_seed_index():
+    # Runs in a thread: the address list plus every address SmartHub has verified before
+    seed = AddressIndex()
+    seed.load_file()
+    seed.add_many(
+        (f"{street.title()}, {city.title()}, {state.upper()}" for street, city, state in result_store.verified_keys()),
+        verified=True,
+    )
+    return seed
+
+async def seed_address_index():
+    # Built off the event loop and merged in one pass, so startup never waits on a large list
+    started = time.perf_counter()
+    seed = await asyncio.to_thread(build_seed_index)
+    added = address_index.merge(seed)
+    log.info("Address suggestions seeded with %s addresses in %.2fs.", added, time.perf_counter() - started)
+
+async def warm_up_browser():
+    global browser_manager
+    # Keep one headless browser running in the background with pre-navigated Shop.html pages,
+    # so lookups skip the GWT bootstrap
+    while True:
+        manager = BrowserManager(f"{SMARTHUB_BASE_URL}/Shop.html", setup_page=install_routes)
+        try:
+            await manager.start()
+            break
+        except asyncio.CancelledError:
+            # Shut down mid-launch: don't leave a half-started Playwright driver behind
+            await manager.close()
+            raise
+        except Exception as e:
+            log.warning("Browser warm-up failed, retrying in %ss: %s", BROWSER_WARMUP_RETRY, e)
+            try:
+                await manager.close()
+            except Exception:
+                pass
+            await asyncio.sleep(BROWSER_WARMUP_RETRY)
+    browser_manager = manager
+    browser_ready.set()
+    record_startup("browser_ready")
+    log.info("Background browser pool started.")
+
 @app.on_event("shutdown")
 async def shutdown_event():
-    global pw, browser
-    if browser:
-        await browser.close()
-    if pw:
-        await pw.stop()
-    print("Background browser pool stopped.")
-
-@app.get("/api/check")
-async def check_availability(address: str):
-    if not address:
-        raise HTTPException(status_code=400, detail="Address is required")
+    global browser_manager, rpc_client, token_refresher
+    if warmup_task:
+        warmup_task.cancel()
+        try:
+            await warmup_task
+        except asyncio.CancelledError:
+            pass
+    if seed_task and not seed_task.done():
+        # The thread finishes on its own; only the merge is skipped
+        seed_task.cancel()
+    if token_refresher:
+        await token_refresher.stop()
+    if rpc_client:
+        await rpc_client.close()
+    if browser_manager:
+        await browser_manager.close()
+    await result_store.close()
+    await tracing.exporter.close()
+    log.info("Background browser pool stopped.")
 
+def parse_address(address):
     # Parse address parts
     parts = [p.strip() for p in address.replace('\n', ', ').split(',')]
     if len(parts) >= 3:
@@ -60,158 +435,378 @@ async def check_availability(address: str):
             street = address
             city = ""
             state = "OR"
-        
-    state_mapping = {'OR': 'Oregon', 'WA': 'Washington', 'CA': 'California', 'ID': 'Idaho'}
-    state_label = state_mapping.get(state.upper(), "Oregon")
+    return street, city, state
 
+def state_code(state):
+    # "OR" and "Oregon" both come back as "OR"; SmartHub records may carry either form
+    state = state.strip()
+    for code, label in STATE_MAPPING.items():
+        if state.lower() == label.lower():
+            return code
+    return state.upper()
+
+def matches_location(address, city, state):
+    # The rpc fast path searches by street only, so a match elsewhere in the territory must not count.
+    # Empty fields on the record are treated as unknown rather than as a mismatch.
+    if city and address.get("city") and address["city"].strip().lower() != city.strip().lower():
+        return False
+    if state and address.get("state") and state_code(address["state"]) != state_code(state):
+        return False
+    return True
+
+def classify_response(captured_response, city="", state=""):
+    if not captured_response:
+        return {"status": "error", "message": NETWORK_ERROR_MESSAGE}
     try:
-        page = await browser.new_page()
-        
-        # Load the page to ensure we have the nocache tokens and JSESSIONID
-        await page.goto("https://peak.smarthub.coop/Shop.html", wait_until="domcontentloaded")
-        
-        # We need the RPC hash and permutation... but wait! We can just use the playwright network interception
-        # to capture the real payload it generates when we type anything, replace the address string, and send it back!
-        
-        # Setup the interceptor to catch the MemberService request, swap the address, and resume
-        search_str = street if street else address
-        
-        captured_response = None
-        
-        async def intercept_request(route, request):
-            nonlocal captured_response
-            if request.method == "POST" and "gwt/MemberService" in request.url:
-                post_data = request.post_data
-                if post_data and "getAddressForMember" in post_data:
-                    # GWT payloads encode strings. We will find "1900 West Oak Street" or whatever we typed
-                    # and replace it with our target search_str
-                    # But actually we can just type the TARGET search_str in the UI directly and we don't even need to replace!
-                    pass
-            await route.continue_()
-            
-        await page.route("**/*", intercept_request)
-        
-        # Now just fill the form normally in Playwright. 
-        # But wait, earlier we found Playwright was timing out on the form fields because of GWT.
-        # Let's fix the form interaction to be perfectly reliable.
-        
-        # 1. Wait for page to settle
-        await asyncio.sleep(1)
-        
-        # 2. Select state using JavaScript to bypass flaky UI
-        await page.evaluate(f'''() => {{
-            const selects = document.querySelectorAll('select');
-            if(selects.length > 0) {{
-                // Find Oregon option
-                const opts = Array.from(selects[0].options);
-                const targetOpt = opts.find(o => o.text.includes('{state_label}'));
-                if(targetOpt) {{
-                    selects[0].value = targetOpt.value;
-                    selects[0].dispatchEvent(new Event('change', {{ bubbles: true }}));
-                }}
-            }}
-        }}''')
-        
-        await asyncio.sleep(0.5)
-        
-        # 3. Select city using JavaScript
-        if city:
-            await page.evaluate(f'''() => {{
-                const selects = document.querySelectorAll('select');
-                if(selects.length > 1) {{
-                    const opts = Array.from(selects[1].options);
-                    const targetOpt = opts.find(o => o.text.includes('{city}'));
-                    if(targetOpt) {{
-                        selects[1].value = targetOpt.value;
-                        selects[1].dispatchEvent(new Event('change', {{ bubbles: true }}));
-                    }}
-                }}
-            }}''')
-            
-        await asyncio.sleep(0.5)
-        
-        # 4. Fill street
-        input_el = page.locator("input.gwt-SuggestBox.form-control").first
-        await input_el.fill(street, force=True)
-        await input_el.press("Enter")
-        await input_el.press("Tab")
-        
-        # Click Go and wait for response simultaneously
-        try:
-            go_button = page.locator("button.btn-primary:has-text('Go!')").first
-            
-            # Start waiting for the network response before clicking
-            async def verify_gwt_response(response):
-                return response.request.method == "POST" and "MemberService" in response.url
-                
-            async with page.expect_response(verify_gwt_response, timeout=10000) as response_info:
-                await go_button.click(force=True, timeout=5000)
-                print("Clicked Go Button via Playwright")
-                
-            response = await response_info.value
-            captured_response = await response.text()
-            print("Captured Response length:", len(captured_response))
-            
-        except Exception as e:
-            print("Failed to click Go Button or timed out waiting for response:", e)
+        addresses = decode_addresses(captured_response)
+    except GwtException as e:
+        log.info("SmartHub MemberService returned an exception: %s", e)
+        return {"status": "error", "message": NOT_VERIFIED_MESSAGE}
+    except DecodeError as e:
+        # A layout we don't know yet: keep the old prefix test rather than failing the lookup
+        log.warning("Could not decode MemberService response: %s", e)
+        # Without a record to read the city from, at least require the response to mention it
+        if captured_response.startswith("//OK") and (not city or city.lower() in captured_response.lower()):
+            return {"status": "success", "message": "Address verified!"}
+        return {"status": "error", "message": NOT_VERIFIED_MESSAGE}
+    addresses = [a for a in addresses if matches_location(a, city, state)]
+    if not addresses:
+        return {"status": "error", "message": NOT_VERIFIED_MESSAGE}
+    return {
+        "status": "success",
+        "message": "Address found and verified by SmartHub!",
+        "addresses": addresses,
+    }
+
+@app.get("/api/check", dependencies=[rate_limited("check")])
+async def check_availability(address: str):
+    if not address:
+        raise HTTPException(status_code=400, detail="Address is required")
+    try:
+        return await check_address(address)
+    except QueueFull as e:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "error", "message": BUSY_MESSAGE},
+            headers={"Retry-After": str(e.retry_after)},
+        )
+
+@app.get("/api/suggest", dependencies=[rate_limited("suggest")])
+async def suggest_addresses(q: str = "", limit: int = SUGGEST_LIMIT):
+    # Answered from memory only, so the front end can call it on every keystroke
+    limit = max(1, min(limit, SUGGEST_MAX_LIMIT))
+    return {"query": q, "suggestions": address_index.suggest(q, limit)}
+
+@app.post("/api/check/batch", dependencies=[rate_limited("batch")])
+async def check_availability_batch(batch: BatchCheckRequest):
+    if not batch.addresses:
+        raise HTTPException(status_code=400, detail="At least one address is required")
+    if len(batch.addresses) > BATCH_MAX_ADDRESSES:
+        raise HTTPException(status_code=413, detail=f"A batch may contain at most {BATCH_MAX_ADDRESSES} addresses")
+    return StreamingResponse(stream_batch_results(batch.addresses), media_type="application/x-ndjson")
+
+async def stream_batch_results(addresses):
+    # One NDJSON line per address, written as soon as its lookup finishes (not in request order)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run(index, address):
+        if not address or not address.strip():
+            return index, address, {"status": "error", "message": "Address is required"}
+        async with semaphore:
             try:
-                # Start wait again for JS fallback
-                async def verify_gwt_response(response):
-                    return response.request.method == "POST" and "MemberService" in response.url
-                    
-                async with page.expect_response(verify_gwt_response, timeout=10000) as response_info:
-                    await page.evaluate('''() => {
-                        const btns = Array.from(document.querySelectorAll('button'));
-                        const goBtn = btns.find(b => b.textContent.includes('Go!'));
-                        if(goBtn) goBtn.click();
-                    }''')
-                    print("Clicked Go Button via JS")
-                    
-                response = await response_info.value
-                captured_response = await response.text()
-            except Exception as e2:
-                print("JS Click also failed:", e2)
-                return {"status": "error", "message": "Submit button not found or network timed out."}
-                
-        # Address matching verify list (a second Go button becomes visible for fuzzy matches)
-        await asyncio.sleep(2)
-        try:
-            verify_go_buttons = page.locator("button.btn-primary:has-text('Go!')")
-            count = await verify_go_buttons.count()
-            for i in range(count):
-                btn = verify_go_buttons.nth(i)
-                if await btn.is_visible() and await btn.is_enabled():
-                    # We could also wait for response here, but usually the first response gave us standard GWT OK array
-                    await btn.click(force=True, timeout=3000)
-                    print("Clicked secondary Go button for verify list")
-                    await asyncio.sleep(2)
-        except:
-            pass
-            
-        if captured_response:
-            if captured_response.startswith("//OK"):
-                if "addresses" in captured_response.lower() or "zip" in captured_response.lower():
-                     return {"status": "success", "message": "Address found and verified by SmartHub!"}
-                else:
-                     return {"status": "success", "message": "Address verified!"}
-            else:
-                return {"status": "error", "message": "SmartHub could not verify this address, or more specific City/State filtering is required."}
-        else:
-             return {"status": "error", "message": f"Network error from SmartHub or request timed out"}
-            
+                return index, address, await check_address(address, BATCH)
+            except QueueFull as e:
+                return index, address, {"status": "error", "message": BUSY_MESSAGE, "retry_after": e.retry_after}
+
+    tasks = [asyncio.create_task(run(i, a)) for i, a in enumerate(addresses)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, address, result = await next_done
+            yield json.dumps({"index": index, "address": address, **result}) + "\n"
+    finally:
+        # Client went away mid-stream: stop queued lookups from starting
+        for task in tasks:
+            task.cancel()
+
+@app.post("/api/check/jobs", status_code=202, dependencies=[rate_limited("jobs")])
+async def submit_check_job(request: JobRequest):
+    if not request.address or not request.address.strip():
+        raise HTTPException(status_code=400, detail="Address is required")
+    try:
+        job = job_store.create(request.address)
+    except StoreFull:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "error", "message": BUSY_MESSAGE},
+            headers={"Retry-After": str(admission.retry_after())},
+        )
+    task = asyncio.create_task(run_check_job(job))
+    job_tasks.add(task)
+    task.add_done_callback(job_tasks.discard)
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "poll": f"/api/check/jobs/{job.id}",
+        "events": f"/api/check/jobs/{job.id}/events",
+    }
+
+@app.get("/api/check/jobs/{job_id}")
+async def get_check_job(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+    return job.snapshot()
+
+@app.get("/api/check/jobs/{job_id}/events")
+async def stream_check_job(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job")
+
+    async def events():
+        async for entry in job.stream():
+            yield format_sse(entry)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+async def run_check_job(job):
+    job.set_stage("queued")
+    try:
+        result = await check_address(job.address, INTERACTIVE, progress=job.set_stage)
+    except QueueFull as e:
+        result = {"status": "error", "message": BUSY_MESSAGE, "retry_after": e.retry_after}
     except Exception as e:
-        print("API unhandled exception:", e)
-        return {"status": "error", "message": "An internal error occurred while validating the address."}
+        log.exception("Check job failed: %s", e)
+        result = {"status": "error", "message": INTERNAL_ERROR_MESSAGE}
+    job.finish(result)
+
+async def check_address(address, priority=INTERACTIVE, progress=None):
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        result = await resolve_address(address, priority, progress)
+        outcome = lookup_outcome(result)
+        return result
+    except QueueFull:
+        outcome = "rejected"
+        raise
     finally:
+        metrics.CHECK_REQUESTS.inc(outcome)
+        metrics.CHECK_SECONDS.observe(time.perf_counter() - start)
+
+def report(progress, stage):
+    if progress:
+        progress(stage)
+
+async def resolve_address(address, priority, progress=None):
+    street, city, state = parse_address(address)
+    key = cache_key(street, city, state)
+
+    with tracing.span("cache"):
+        cached = result_cache.get(key)
+    if cached is not None:
+        metrics.LOOKUP_PATHS.inc("cache")
+        report(progress, "cache")
+        return dict(cached)
+
+    # Identical addresses checked at the same moment share one upstream lookup.
+    # Only the caller that starts it sees the detailed stages; the rest just wait on it.
+    if key in lookup_flight:
+        report(progress, "coalesced")
+    result = await lookup_flight.do(key, lambda: lookup_and_cache(key, address, street, city, state, priority, progress))
+    return dict(result)
+
+async def lookup_and_cache(key, address, street, city, state, priority, progress=None):
+    if not upstream_breaker.allow():
+        # Circuit open: answer from the last good result if we have one, otherwise fail fast
+        stale = result_cache.get_stale(key)
+        if stale is not None:
+            CIRCUIT_REJECTED.inc("stale")
+            report(progress, "stale")
+            return {**stale, "stale": True}
+        CIRCUIT_REJECTED.inc("fail_fast")
+        return {"status": "error", "message": UPSTREAM_DOWN_MESSAGE}
+
+    # Only time spent talking to SmartHub is judged as upstream latency; admission and warm-up
+    # waits are local queueing and must not open the circuit
+    upstream = {"seconds": 0.0}
+    try:
+        result = await lookup_address(address, street, city, state, priority, progress, upstream)
+    except BaseException:
+        upstream_breaker.release()
+        raise
+
+    if lookup_outcome(result) in ("success", "not_verified"):
+        upstream_breaker.record_success(upstream["seconds"])
+        if result.get("status") == "success":
+            index_verified(result, street, city, state)
+    else:
+        upstream_breaker.record_failure()
+        stale = result_cache.get_stale(key)
+        if stale is not None:
+            # Keep serving the last good answer rather than replacing it with an error
+            return {**stale, "stale": True}
+
+    result_cache.put(key, result)
+    return result
+
+def index_verified(result, street, city, state):
+    # Suggest SmartHub's spelling of what it matched; what the user typed may carry typos or a unit
+    records = [a for a in result.get("addresses") or [] if a.get("street")]
+    if not records:
+        # Verified by the //OK fallback, with no record to read the canonical form from
+        address_index.add(f"{street}, {city}, {state.upper()}", verified=True)
+        return
+    for a in records:
+        address_index.add(f"{a['street']}, {a.get('city') or city}, {state_code(a.get('state') or state)}", verified=True)
+
+async def lookup_address(address, street, city, state, priority=INTERACTIVE, progress=None, upstream=None):
+    state_label = STATE_MAPPING.get(state.upper(), "Oregon")
+
+    # Fast path: replay the MemberService call directly with the scraped session tokens
+    if rpc_client and rpc_client.available:
+        report(progress, "rpc")
+        rpc_start = time.perf_counter()
         try:
-            # We must gracefully close the page or memory leaks will crush the server
-            await page.close()
-        except:
-            pass
+            with tracing.span("rpc"):
+                captured_response = await rpc_client.get_address_for_member(street if street else address)
+            metrics.LOOKUP_PATHS.inc("rpc")
+            return classify_response(captured_response, city, state)
+        except TokensRejected as e:
+            # Drop the stale tokens so later lookups go straight to the browser until they are refreshed
+            log.warning("SmartHub rejected stored tokens, falling back to browser: %s", e)
+            rpc_client.invalidate(e.tokens)
+            if token_refresher:
+                token_refresher.request_refresh()
+        except httpx.HTTPError as e:
+            log.warning("Direct MemberService call failed: %s", e)
+            return {"status": "error", "message": NETWORK_ERROR_MESSAGE}
+        finally:
+            rpc_seconds = time.perf_counter() - rpc_start
+            metrics.STAGE_SECONDS.observe(rpc_seconds, "rpc")
+            if upstream is not None:
+                upstream["seconds"] += rpc_seconds
+
+    if not browser_ready.is_set():
+        # Right after a deploy: give warm-up a moment, then turn the lookup away like a full queue
+        report(progress, "waiting_for_warmup")
+        try:
+            with tracing.span("warmup"):
+                await asyncio.wait_for(browser_ready.wait(), BROWSER_READY_WAIT)
+        except asyncio.TimeoutError:
+            # Retry-After takes whole seconds
+            raise QueueFull(priority, max(1, math.ceil(BROWSER_WARMUP_RETRY))) from None
+
+    # Raises QueueFull straight away when the browser is saturated, rather than piling on more pages
+    report(progress, "waiting_for_browser")
+    queued_at = time.perf_counter()
+    async with admission.slot(priority):
+        tracing.record("admission", time.perf_counter() - queued_at)
+        metrics.LOOKUP_PATHS.inc("browser")
+        return await browser_lookup(address, street, city, state, state_label, progress, upstream)
+
+async def install_routes(page):
+    # Called once when the pool opens a page, so handlers never stack up across leases
+    await resource_router.install(page, routing_policy, asset_cache)
+
+def record_route_savings(page, before):
+    stats = resource_router.stats_for(page)
+    if stats is None or before is None:
+        return
+    delta = stats.since(before)
+    for k, v in delta.items():
+        route_totals[k] = route_totals.get(k, 0) + v
+    log.info("Lookup routing", extra={"sample": True, **delta})
+
+async def browser_lookup(address, street, city, state, state_label, progress=None, upstream=None):
+    timings = StepTimings(on_step=progress)
+    try:
+        # Exceptions escape the lease so the page is discarded and replaced rather than reused
+        # A lookup caught waiting on a pool that was just recycled retries once on the new one
+        for attempt in range(2):
+            try:
+                lease_started = time.perf_counter()
+                async with browser_manager.pool.lease() as page:
+                    tracing.record("lease", time.perf_counter() - lease_started)
+                    stats = resource_router.stats_for(page)
+                    before = stats.snapshot() if stats else None
+                    form_started = time.perf_counter()
+                    try:
+                        captured_response = await fill_shop_form(page, street, city, state_label, timings, option_maps)
+                    finally:
+                        if upstream is not None:
+                            upstream["seconds"] += time.perf_counter() - form_started
+                        record_route_savings(page, before)
+                # state_label is only what the form's dropdown shows; records are matched on the code
+                return classify_response(captured_response, city, state)
+            except PoolClosed:
+                if attempt:
+                    raise
+    except SubmitFailed:
+        return {"status": "error", "message": SUBMIT_TIMEOUT_MESSAGE}
+    except Exception as e:
+        log.exception("API unhandled exception: %s", e)
+        return {"status": "error", "message": INTERNAL_ERROR_MESSAGE}
+    finally:
+        log.info("Browser lookup steps: %s", timings.summary(), extra={"sample": True})
+        for stage, seconds in timings.steps.items():
+            metrics.STAGE_SECONDS.observe(seconds, stage)
+
+@app.get("/readyz")
+async def readyz():
+    # Ready once a lookup can actually be served: warm pool pages, or tokens for the rpc fast path
+    pages = browser_manager.pool.open_pages if browser_manager and browser_manager.pool else 0
+    rpc = bool(rpc_client and rpc_client.available)
+    ready = pages > 0 or rpc
+    body = {
+        "ready": ready,
+        "browser_pages": pages,
+        "rpc": rpc,
+        "uptime_seconds": round(time.monotonic() - PROCESS_STARTED, 3),
+        "startup_seconds": startup_times,
+    }
+    return JSONResponse(status_code=200 if ready else 503, content=body)
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/stats")
+async def service_stats():
+    return {
+        "cache": result_cache.stats(),
+        "suggest": address_index.stats(),
+        "store": result_store.stats(),
+        "single_flight": {
+            "inflight": lookup_flight.inflight,
+            "leaders": lookup_flight.leaders,
+            "followers": lookup_flight.followers,
+        },
+        "admission": admission.stats(),
+        "jobs": job_store.stats(),
+        "browser": browser_manager.stats() if browser_manager else None,
+        "circuit": upstream_breaker.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "routing": route_totals,
+        "assets": asset_cache.stats() if asset_cache else {"enabled": False},
+        "select_options": option_maps.stats(),
+        "static": static_files.stats(),
+        "logging": structured_log.stats(),
+    }
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
-app.mount("/", StaticFiles(directory=current_dir, html=True), name="static")
+# The session tokens and runtime state live next to the site files; never hand them out,
+# including when the env points the store, traces or asset cache somewhere inside the site
+static_files = StaticFiles(
+    directory=current_dir, html=True, manifest=MANIFEST_FILE,
+    exclude=[TOKEN_FILE, VAR_DIR, AVAILABILITY_DB, TRACE_FILE, ASSET_CACHE_DIR],
+)
+app.mount("/", static_files, name="static")
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8005)
+    # Listens on localhost only, so visitors reach it through a reverse proxy. Run it with
+    # RATE_LIMIT_TRUST_PROXY=1 there (and have the proxy set X-Forwarded-For), otherwise every
+    # visitor is rate-limited as the proxy's one address and shares a single bucket.
+    # log_config=None leaves uvicorn's loggers (access log included) on the queued root handler
+    uvicorn.run(app, host="127.0.0.1", port=8005, log_config=None)
 
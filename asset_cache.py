@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from urllib.parse import urlsplit
+
+from runtime_paths import VAR_DIR
+from smarthub_rpc import SMARTHUB_BASE_URL
+
+# Content-addressed disk cache of SmartHub's static responses (the GWT <strong name>.cache.js
+# bundle, stylesheets, fonts and images), replayed into the headless pages through page.route,
+# so a fresh page only goes upstream for Shop.html, the nocache.js selector and MemberService.
+# Bodies are stored once under their SHA-256; the index maps a URL to a body. GWT names the
+# compiled bundle after the permutation's strong name, so those URLs never change content and
+# are cached as they are. Every other asset is keyed by URL *and* the permutation currently
+# deployed: when a page loads a new permutation or sends a different X-GWT-Permutation, the
+# portal has been redeployed and those entries are dropped.
+
+log = logging.getLogger(__name__)
+
+ASSET_CACHE = os.environ.get("ASSET_CACHE", "1") == "1"
+ASSET_CACHE_DIR = os.environ.get("ASSET_CACHE_DIR", os.path.join(VAR_DIR, "asset_cache"))
+ASSET_CACHE_EXTENSIONS = (".js", ".css", ".png", ".gif", ".jpg", ".jpeg", ".svg", ".ico", ".woff", ".woff2", ".ttf", ".eot")
+
+# <strong name>.cache.js (or .cache.html / .cache.png for GWT's image bundles)
+STRONG_NAME_RE = re.compile(r"/([0-9A-F]{32})\.cache\.[a-z]+$")
+# Headers worth replaying; the body is stored decoded, so no Content-Encoding/Length
+KEPT_HEADERS = ("content-type", "cache-control", "last-modified", "etag")
+
+
+def blob_name(digest):
+    return os.path.join(digest[:2], digest)
+
+
+class AssetCache:
+    def __init__(self, directory=ASSET_CACHE_DIR, base_url=SMARTHUB_BASE_URL):
+        self.directory = directory
+        self.host = urlsplit(base_url).netloc
+        self.index_path = os.path.join(directory, "index.json")
+        self.permutation = None
+        # key -> {"digest", "status", "headers", "size", "permutation"}
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.bytes_served = 0
+        self.bytes_fetched = 0
+        self.invalidations = 0
+        self.errors = 0
+        self._prune_task = None
+
+    def load(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            log.warning("Asset cache index %s unreadable, starting empty: %s", self.index_path, e)
+            return
+        self.permutation = index.get("permutation")
+        self.entries = index.get("entries", {})
+        log.info("Asset cache loaded %s entries for permutation %s", len(self.entries), self.permutation)
+
+    def _save(self, index):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = f"{self.index_path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp, self.index_path)
+
+    async def save(self):
+        try:
+            await asyncio.to_thread(self._save, {"permutation": self.permutation, "entries": dict(self.entries)})
+        except OSError as e:
+            self.errors += 1
+            log.warning("Asset cache index write failed: %s", e)
+
+    def matches(self, url):
+        # page.route predicate: static files from the SmartHub host, except the permutation selector
+        parts = urlsplit(url)
+        return (
+            parts.netloc == self.host
+            and parts.path.lower().endswith(ASSET_CACHE_EXTENSIONS)
+            and not parts.path.endswith(".nocache.js")
+        )
+
+    def key(self, url):
+        if STRONG_NAME_RE.search(urlsplit(url).path):
+            return url
+        # Unknown permutation: no way to tell whether a stored copy is current
+        return f"{self.permutation}|{url}" if self.permutation else None
+
+    def observe_permutation(self, permutation):
+        if not permutation or permutation == self.permutation:
+            return False
+        dropped = []
+        if self.permutation is not None:
+            log.info("SmartHub permutation changed %s -> %s, dropping cached assets", self.permutation, permutation)
+            self.invalidations += 1
+            # Including the old strong-name bundle: the new permutation loads a different one
+            dropped = [e["digest"] for e in self.entries.values() if e.get("permutation") != permutation]
+            self.entries = {k: v for k, v in self.entries.items() if v.get("permutation") == permutation}
+        self.permutation = permutation
+        self._prune_task = asyncio.create_task(self.prune(dropped))
+        return True
+
+    def _read(self, digest):
+        with open(os.path.join(self.directory, blob_name(digest)), "rb") as f:
+            return f.read()
+
+    def _write(self, digest, body):
+        path = os.path.join(self.directory, blob_name(digest))
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(body)
+        os.replace(tmp, path)
+
+    def _remove(self, digests):
+        for digest in digests:
+            try:
+                os.remove(os.path.join(self.directory, blob_name(digest)))
+            except FileNotFoundError:
+                pass
+
+    async def prune(self, digests):
+        # Persist the new permutation and delete the bodies only old entries referenced
+        await self.save()
+        keep = {e["digest"] for e in self.entries.values()}
+        try:
+            await asyncio.to_thread(self._remove, [d for d in set(digests) if d not in keep])
+        except OSError as e:
+            self.errors += 1
+            log.warning("Asset cache prune failed: %s", e)
+
+    async def handle(self, route, request):
+        # Returns the number of bytes replayed from disk, 0 when the request went upstream
+        url = request.url
+        match = STRONG_NAME_RE.search(urlsplit(url).path)
+        if match and url.endswith(".cache.js"):
+            self.observe_permutation(match.group(1))
+        key = self.key(url)
+        entry = self.entries.get(key) if key else None
+        if entry is not None:
+            try:
+                body = await asyncio.to_thread(self._read, entry["digest"])
+            except OSError:
+                # Blob went missing under us; forget the entry and fetch it again
+                self.entries.pop(key, None)
+            else:
+                await route.fulfill(status=entry["status"], headers=entry["headers"], body=body)
+                self.hits += 1
+                self.bytes_served += len(body)
+                return len(body)
+
+        self.misses += 1
+        try:
+            response = await route.fetch()
+            body = await response.body()
+        except Exception as e:
+            log.warning("Asset cache fetch of %s failed, passing the request through: %s", url, e)
+            await route.continue_()
+            return 0
+        headers = {k: v for k, v in response.headers.items() if k.lower() in KEPT_HEADERS}
+        await route.fulfill(status=response.status, headers=headers, body=body)
+        self.bytes_fetched += len(body)
+        if key and response.status == 200 and "no-store" not in headers.get("cache-control", ""):
+            await self.store(key, headers, body)
+        return 0
+
+    async def store(self, key, headers, body):
+        digest = hashlib.sha256(body).hexdigest()
+        try:
+            await asyncio.to_thread(self._write, digest, body)
+        except OSError as e:
+            self.errors += 1
+            log.warning("Asset cache write failed: %s", e)
+            return
+        self.entries[key] = {
+            "digest": digest, "status": 200, "headers": headers, "size": len(body), "permutation": self.permutation,
+        }
+        self.stored += 1
+        await self.save()
+
+    def stats(self):
+        return {
+            "enabled": True,
+            "permutation": self.permutation,
+            "entries": len(self.entries),
+            "bytes": sum(e["size"] for e in self.entries.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "stored": self.stored,
+            "bytes_served": self.bytes_served,
+            "bytes_fetched": self.bytes_fetched,
+            "invalidations": self.invalidations,
+            "errors": self.errors,
+        }
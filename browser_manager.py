@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import os
+import time
+
+
+from page_pool import PagePool, PAGE_POOL_SIZE
+import metrics
+
+# Owns the long-lived Chromium and its page pool. A watchdog samples Chromium's memory
+# and recycles the browser after a number of lookups or above an RSS threshold: the new
+# browser and pool take new leases straight away while the old pool drains its in-flight
+# lookups before being closed. An unexpected disconnect triggers an immediate relaunch.
+
+log = logging.getLogger(__name__)
+
+BROWSER_RECYCLE_AFTER_LOOKUPS = int(os.environ.get("BROWSER_RECYCLE_AFTER_LOOKUPS", "2000"))
+BROWSER_MAX_RSS_MB = float(os.environ.get("BROWSER_MAX_RSS_MB", "1500"))
+BROWSER_WATCHDOG_INTERVAL = float(os.environ.get("BROWSER_WATCHDOG_INTERVAL", "30"))
+BROWSER_DRAIN_TIMEOUT = float(os.environ.get("BROWSER_DRAIN_TIMEOUT", "60"))
+# Backoff between relaunch attempts after a crash, doubling up to the cap
+BROWSER_RELAUNCH_BACKOFF = float(os.environ.get("BROWSER_RELAUNCH_BACKOFF", "1"))
+BROWSER_RELAUNCH_MAX_BACKOFF = float(os.environ.get("BROWSER_RELAUNCH_MAX_BACKOFF", "60"))
+
+CHROMIUM_PROCESS_NAMES = ("chrom", "headless_shell")
+
+
+def _proc_children():
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # comm is wrapped in parentheses and may itself contain spaces
+        comm = stat[stat.index("(") + 1:stat.rindex(")")]
+        ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        children.setdefault(ppid, []).append((int(entry), comm))
+    return children
+
+
+def chromium_rss_bytes():
+    # Sum resident memory over the Chromium processes below this one (driver -> browser -> renderers)
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+
+    if psutil is not None:
+        total = 0
+        for child in psutil.Process().children(recursive=True):
+            try:
+                if any(n in child.name().lower() for n in CHROMIUM_PROCESS_NAMES):
+                    total += child.memory_info().rss
+            except psutil.Error:
+                continue
+        return total
+
+    if not os.path.isdir("/proc"):
+        return None
+    children = _proc_children()
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    stack = [os.getpid()]
+    while stack:
+        for pid, comm in children.get(stack.pop(), []):
+            stack.append(pid)
+            if any(n in comm.lower() for n in CHROMIUM_PROCESS_NAMES):
+                try:
+                    with open(f"/proc/{pid}/statm", "r") as f:
+                        total += int(f.read().split()[1]) * page_size
+                except OSError:
+                    continue
+    return total
+
+
+class BrowserManager:
+    def __init__(self, url, setup_page=None, pool_size=PAGE_POOL_SIZE,
+                 recycle_after_lookups=BROWSER_RECYCLE_AFTER_LOOKUPS, max_rss_mb=BROWSER_MAX_RSS_MB,
+                 watchdog_interval=BROWSER_WATCHDOG_INTERVAL, drain_timeout=BROWSER_DRAIN_TIMEOUT):
+        self.url = url
+        self.setup_page = setup_page
+        self.pool_size = pool_size
+        self.recycle_after_lookups = recycle_after_lookups
+        self.max_rss_bytes = max_rss_mb * 1024 * 1024
+        self.watchdog_interval = watchdog_interval
+        self.drain_timeout = drain_timeout
+        self.pw = None
+        self.browser = None
+        self.pool = None
+        self.generation = 0
+        self.launched_at = None
+        self.last_rss = None
+        self._recycle_lock = asyncio.Lock()
+        self._watchdog = None
+        self._relaunch_task = None
+        self._retiring = set()
+        self._closing = False
+
+    @property
+    def contexts(self):
+        return len(self.browser.contexts) if self.browser else 0
+
+    async def start(self):
+        # Imported here so loading the API doesn't pay for Playwright before it serves anything
+        from playwright.async_api import async_playwright
+        # Cancelled halfway through, the driver start leaves Playwright's connection task running
+        # with no handle to stop it; so it is shielded, and a cancelled start is finished and stopped
+        starting = asyncio.ensure_future(async_playwright().start())
+        try:
+            self.pw = await asyncio.shield(starting)
+        except asyncio.CancelledError:
+            try:
+                pw = await starting
+            except Exception:
+                pass
+            else:
+                await pw.stop()
+            raise
+        await self._launch()
+        self._watchdog = asyncio.create_task(self._watch())
+
+    async def close(self):
+        self._closing = True
+        if self._watchdog:
+            self._watchdog.cancel()
+        if self._relaunch_task:
+            self._relaunch_task.cancel()
+        for task in list(self._retiring):
+            task.cancel()
+        if self.pool:
+            await self.pool.close()
+        if self.browser:
+            try:
+                await self.browser.close()
+            except Exception:
+                pass
+        if self.pw:
+            await self.pw.stop()
+
+    async def _launch(self):
+        browser = await self.pw.chromium.launch(headless=True)
+        browser.on("disconnected", self._on_disconnected)
+        pool = PagePool(browser, self.url, self.pool_size, setup_page=self.setup_page)
+        await pool.start()
+        # Swap both at once; new leases go to the new pool from here on
+        self.browser, self.pool = browser, pool
+        self.generation += 1
+        self.launched_at = time.monotonic()
+
+    def _on_disconnected(self, browser):
+        if self._closing or browser is not self.browser:
+            return
+        log.error("Chromium disconnected unexpectedly, relaunching.")
+        if self._relaunch_task is None or self._relaunch_task.done():
+            self._relaunch_task = asyncio.create_task(self._relaunch())
+
+    @property
+    def connected(self):
+        return self.browser is not None and self.browser.is_connected()
+
+    async def _relaunch(self):
+        # Keep trying until a browser is up again; one failed launch must not leave the service without one
+        delay = BROWSER_RELAUNCH_BACKOFF
+        while not self._closing and not self.connected:
+            if await self.recycle("disconnected", drain=False):
+                return
+            log.warning("Chromium relaunch failed, retrying in %ss.", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BROWSER_RELAUNCH_MAX_BACKOFF)
+
+    async def recycle(self, reason, drain=True):
+        if self._recycle_lock.locked():
+            return False
+        async with self._recycle_lock:
+            old_browser, old_pool = self.browser, self.pool
+            log.info("Recycling Chromium (%s), generation %s.", reason, self.generation)
+            try:
+                await self._launch()
+            except Exception as e:
+                log.error("Failed to launch replacement browser: %s", e)
+                return False
+            metrics.BROWSER_RESTARTS.inc(reason)
+            task = asyncio.create_task(self._retire(old_browser, old_pool, drain))
+            self._retiring.add(task)
+            task.add_done_callback(self._retiring.discard)
+            return True
+
+    async def _retire(self, browser, pool, drain):
+        if drain and not await pool.drain(self.drain_timeout):
+            log.warning("Old browser still had %s pages leased after %ss, closing anyway.", pool.in_use, self.drain_timeout)
+        await pool.close()
+        try:
+            await browser.close()
+        except Exception:
+            pass
+
+    def recycle_reason(self):
+        # Backstop for a relaunch that gave up or never started: a dead browser has no RSS or leases to trip on
+        if self.browser is not None and not self.browser.is_connected():
+            return "disconnected"
+        if self.pool and self.pool.leases >= self.recycle_after_lookups:
+            return "lookups"
+        if self.last_rss is not None and self.last_rss > self.max_rss_bytes:
+            return "memory"
+        return None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.watchdog_interval)
+            try:
+                self.last_rss = await asyncio.to_thread(chromium_rss_bytes)
+                # More contexts than pool pages plus a token scrape means something is leaking them
+                if self.contexts > self.pool_size + 2:
+                    log.warning("Chromium has %s contexts open for a pool of %s.", self.contexts, self.pool_size)
+                reason = self.recycle_reason()
+                if reason:
+                    await self.recycle(reason, drain=reason != "disconnected")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception("Browser watchdog error: %s", e)
+
+    def stats(self):
+        return {
+            "generation": self.generation,
+            "uptime_seconds": time.monotonic() - self.launched_at if self.launched_at else 0,
+            "rss_bytes": self.last_rss,
+            "contexts": self.contexts,
+            "open_pages": self.pool.open_pages if self.pool else 0,
+            "leased_pages": self.pool.in_use if self.pool else 0,
+            "lookups_since_launch": self.pool.leases if self.pool else 0,
+            "retiring": len(self._retiring),
+        }
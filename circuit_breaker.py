@@ -0,0 +1,92 @@
+import logging
+import os
+import time
+
+import metrics
+
+# Circuit breaker around the SmartHub upstream. Consecutive failures or slow calls open
+# the circuit; while open, lookups fail fast (or are answered from stale cache) instead of
+# each burning the full upstream timeout. After a cool-down a single half-open probe is let
+# through, and its result decides whether the circuit closes again.
+
+log = logging.getLogger(__name__)
+
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_SLOW_CALL_SECONDS = float(os.environ.get("CIRCUIT_SLOW_CALL_SECONDS", "8"))
+CIRCUIT_OPEN_SECONDS = float(os.environ.get("CIRCUIT_OPEN_SECONDS", "30"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_TRANSITIONS = metrics.Counter(
+    "peak_circuit_transitions_total",
+    "SmartHub circuit breaker state changes, by new state.",
+    ["state"],
+)
+CIRCUIT_REJECTED = metrics.Counter(
+    "peak_circuit_short_circuited_total",
+    "Lookups not sent upstream because the circuit was open, by how they were answered (stale, fail_fast).",
+    ["answer"],
+)
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, slow_call_seconds=CIRCUIT_SLOW_CALL_SECONDS,
+                 open_seconds=CIRCUIT_OPEN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def _transition(self, state):
+        if state != self.state:
+            log.warning("SmartHub circuit %s -> %s", self.state, state)
+            self.state = state
+            CIRCUIT_TRANSITIONS.inc(state)
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def allow(self):
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < self.open_seconds:
+                return False
+            self._transition(HALF_OPEN)
+        # Half-open: exactly one probe at a time
+        if self._probe_in_flight:
+            return False
+        self._probe_in_flight = True
+        return True
+
+    def record_success(self, duration):
+        if duration > self.slow_call_seconds:
+            # A latency spike counts against the upstream just like an error
+            self.record_failure()
+            return
+        self.consecutive_failures = 0
+        if self.state != CLOSED:
+            self._transition(CLOSED)
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._transition(OPEN)
+
+    def release(self):
+        # The call was abandoned without telling us anything about the upstream (e.g. local overload)
+        self._probe_in_flight = False
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "open_for_seconds": time.monotonic() - self.opened_at if self.state != CLOSED and self.opened_at else 0,
+        }
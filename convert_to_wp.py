@@ -3,6 +3,8 @@ import re
 import shutil
 import base64
 
+from fingerprint_assets import content_hash, load_manifest
+
 THEME_DIR = 'peak-theme'
 
 def setup_theme_dir():
@@ -18,6 +20,10 @@ def setup_theme_dir():
         shutil.copy('styles.css', os.path.join(THEME_DIR, 'styles.css'))
     if os.path.exists('main.js'):
         shutil.copy('main.js', os.path.join(THEME_DIR, 'main.js'))
+    # Fingerprinted copies from fingerprint_assets.py, enqueued by name in functions.php
+    for hashed in load_manifest().values():
+        if os.path.exists(hashed):
+            shutil.copy(hashed, os.path.join(THEME_DIR, hashed))
 
 def write_style_css():
     with open('styles.css', 'r', encoding='utf-8') as f:
@@ -232,17 +238,23 @@ Text Domain: peak-internet
         f.write(wp_header + "\n/* === MAIN THEME STYLES IMPORTED DIRECTLY === */\n" + main_css)
 
 def write_functions_php():
+    # WordPress requires the stylesheet to be called style.css, so it is versioned by its
+    # content hash instead; main.js is enqueued under its fingerprinted name with no version
+    style_version = content_hash(os.path.join(THEME_DIR, 'style.css'))
+    main_js = load_manifest().get('main.js', 'main.js')
+    main_js_version = 'null' if main_js != 'main.js' else "'" + content_hash('main.js') + "'"
+
     content = """<?php
 function peak_theme_enqueue_styles() {
     // Enqueue the main unified style.css
-    wp_enqueue_style( 'peak-main-style', get_stylesheet_uri(), array(), '1.1' );
+    wp_enqueue_style( 'peak-main-style', get_stylesheet_uri(), array(), '__STYLE_VERSION__' );
     wp_enqueue_style( 'peak-google-fonts', 'https://fonts.googleapis.com/css2?family=Outfit:wght@300;400;500;600;700&family=Inter:wght@400;500;600&display=swap', false );
     
     // Phosphor Icons
     wp_enqueue_script( 'phosphor-icons', 'https://unpkg.com/@phosphor-icons/web', array(), null, false );
     
     // Main JS
-    wp_enqueue_script( 'peak-main-js', get_template_directory_uri() . '/main.js', array(), '1.0', true );
+    wp_enqueue_script( 'peak-main-js', get_template_directory_uri() . '/__MAIN_JS__', array(), __MAIN_JS_VERSION__, true );
 }
 add_action( 'wp_enqueue_scripts', 'peak_theme_enqueue_styles' );
 
@@ -452,6 +464,8 @@ function peak_add_menu_link_class( $atts, $item, $args ) {
 }
 add_filter( 'nav_menu_link_attributes', 'peak_add_menu_link_class', 1, 3 );
 """
+    content = content.replace('__STYLE_VERSION__', style_version)
+    content = content.replace('__MAIN_JS__', main_js).replace('__MAIN_JS_VERSION__', main_js_version)
     with open(os.path.join(THEME_DIR, 'functions.php'), 'w', encoding='utf-8') as f:
         f.write(content)
 
@@ -0,0 +1,93 @@
+import glob
+import hashlib
+import json
+import os
+import re
+
+# Content-hash build for the site's CSS/JS. Copies styles.css and main.js to
+# styles.<hash>.css / main.<hash>.js, points every page at the hashed names and records
+# the mapping in asset-manifest.json. A hashed URL never changes content, so the static
+# server and the theme can let browsers cache those files for a year without revalidating.
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_FILE = os.path.join(ROOT_DIR, 'asset-manifest.json')
+FINGERPRINTED_ASSETS = ['styles.css', 'main.js']
+HASH_LENGTH = 10
+
+# Same-site references only, e.g. "/wp-content/themes/peak-theme/styles.css" or "main.js";
+# other hosts and query-string versions are left alone
+REFERENCE_PREFIX = r'((?:href|src)=")((?:/wp-content/themes/peak-theme/)?)'
+
+
+def content_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:HASH_LENGTH]
+
+
+def fingerprinted_name(name, digest):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{digest}{ext}'
+
+
+def fingerprint_pattern(name):
+    stem, ext = os.path.splitext(name)
+    return re.escape(stem) + r'\.[0-9a-f]{%d}' % HASH_LENGTH + re.escape(ext)
+
+
+def load_manifest(path=MANIFEST_FILE):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def build_assets(root=ROOT_DIR):
+    manifest = {}
+    for name in FINGERPRINTED_ASSETS:
+        source = os.path.join(root, name)
+        if not os.path.exists(source):
+            continue
+        hashed = fingerprinted_name(name, content_hash(source))
+        # Drop builds of earlier content so the directory holds one copy per asset
+        for old in os.listdir(root):
+            if old != hashed and re.fullmatch(fingerprint_pattern(name), old):
+                os.remove(os.path.join(root, old))
+        with open(source, 'rb') as src, open(os.path.join(root, hashed), 'wb') as dst:
+            dst.write(src.read())
+        manifest[name] = hashed
+
+    with open(os.path.join(root, os.path.basename(MANIFEST_FILE)), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+        f.write('\n')
+    return manifest
+
+
+def rewrite_references(content, manifest):
+    for name, hashed in manifest.items():
+        # Matches the plain name and any previous fingerprint of it
+        pattern = REFERENCE_PREFIX + '(' + re.escape(name) + '|' + fingerprint_pattern(name) + ')"'
+        content = re.sub(pattern, lambda m: f'{m.group(1)}{m.group(2)}{hashed}"', content)
+    return content
+
+
+def rewrite_html(manifest, root=ROOT_DIR):
+    count = 0
+    for filepath in glob.glob(os.path.join(root, '*.html')):
+        if os.path.basename(filepath) == 'current_peak.html':
+            continue
+        with open(filepath, 'r', encoding='utf-8') as f:
+            content = f.read()
+        new_content = rewrite_references(content, manifest)
+        if new_content != content:
+            with open(filepath, 'w', encoding='utf-8') as f:
+                f.write(new_content)
+            count += 1
+    return count
+
+
+if __name__ == '__main__':
+    manifest = build_assets()
+    for name, hashed in manifest.items():
+        print(f"{name} -> {hashed}")
+    print(f"Updated CSS/JS references in {rewrite_html(manifest)} files.")
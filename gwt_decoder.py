@@ -0,0 +1,197 @@
+import json
+import os
+import re
+
+# Decoder for GWT-RPC responses from the SmartHub MemberService.
+# A response is "//OK" or "//EX" followed by a JavaScript array:
+#   [value_n, ..., value_1, ["string", "table", ...], flags, version]
+# The values are written in reverse, so the reader walks the array from the end.
+# Positive integers in object positions are 1-based string-table references (type
+# signatures and string fields); negative ones are back-references to objects already read.
+#
+# The Address field layout is NOT taken from a captured SmartHub response; the repo has
+# none. GWT's server serializer writes an object's fields sorted by name (subclass fields
+# before superclass ones), so ADDRESS_FIELDS lists the fields we expect in that order.
+# Records are plain dicts keyed by those names rather than a fixed type, and
+# SMARTHUB_ADDRESS_FIELDS ("name:kind,...", kinds string/boolean/int) replaces the layout
+# without a code change. scraper.py saves the first real response it sees to
+# MEMBER_SERVICE_SAMPLE so the layout can be checked against it.
+
+ADDRESS_TYPE_PREFIX = "coop.nisc.smarthub.consumer.shared.Address/"
+LIST_TYPE_PREFIXES = ("java.util.ArrayList/", "java.util.LinkedList/", "java.util.Collections$UnmodifiableRandomAccessList/")
+
+ADDRESS_FIELDS = (
+    ("city", "string"),
+    ("service", "string"),
+    ("serviceable", "boolean"),
+    ("state", "string"),
+    ("street", "string"),
+    ("zip", "string"),
+)
+
+# GWT splits very long arrays as [...].concat([...]) and escapes some characters as \xNN
+CONCAT_RE = re.compile(r"\]\s*\.concat\(\s*\[")
+HEX_ESCAPE_RE = re.compile(r"(?<!\\)((?:\\\\)*)\\x([0-9a-fA-F]{2})")
+# com.example.Type/1234567890: what a string reference lands on when the layout is off by a field
+TYPE_SIGNATURE_RE = re.compile(r"^[A-Za-z_$][\w$]*(?:\.[\w$]+)+/\d+$")
+
+
+class DecodeError(Exception):
+    # The body is not a GWT-RPC response, or its layout is not one we know
+    pass
+
+
+class GwtException(Exception):
+    # A //EX response: the service threw, e.g. IncompatibleRemoteServiceException for stale tokens
+    def __init__(self, type_name, message):
+        super().__init__(f"{type_name}: {message}" if message else type_name)
+        self.type_name = type_name
+        self.message = message
+
+
+def parse_fields(spec):
+    fields = []
+    for entry in spec.split(","):
+        name, _, kind = entry.strip().partition(":")
+        if name:
+            if (kind or "string") not in FIELD_READERS:
+                raise ValueError(f"unknown field kind {kind!r} for {name}")
+            fields.append((name, kind or "string"))
+    return tuple(fields)
+
+
+def parse_body(body):
+    if not body.startswith(("//OK", "//EX")):
+        raise DecodeError(f"not a GWT-RPC response: {body[:40]!r}")
+    text = body[4:]
+    if ".concat(" in text:
+        # [a,b].concat([c,d]) -> [a,b,c,d], dropping one closing paren per join
+        text, joins = CONCAT_RE.subn(",", text.rstrip())
+        if text.endswith(")" * joins):
+            text = text[:len(text) - joins]
+    if "\\x" in text:
+        text = HEX_ESCAPE_RE.sub(lambda m: m.group(1) + "\\u00" + m.group(2), text)
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise DecodeError(f"malformed GWT-RPC payload: {e}") from None
+    if not isinstance(data, list) or len(data) < 3 or not isinstance(data[-3], list):
+        raise DecodeError("GWT-RPC payload has no string table")
+    return body[:4], data
+
+
+class StreamReader:
+    def __init__(self, data):
+        self.strings = data[-3]
+        self.flags = data[-2]
+        self.version = data[-1]
+        self._values = data[:-3]
+        self._pos = len(self._values)
+        self._seen = []
+
+    @property
+    def remaining(self):
+        return self._pos
+
+    def read_int(self):
+        if self._pos == 0:
+            raise DecodeError("GWT-RPC stream ended early")
+        self._pos -= 1
+        value = self._values[self._pos]
+        if not isinstance(value, (int, float)):
+            raise DecodeError(f"expected a number in the value stream, got {value!r}")
+        return int(value)
+
+    def read_boolean(self):
+        return self.read_int() != 0
+
+    def string_at(self, ref):
+        if ref == 0:
+            return None
+        if not 0 < ref <= len(self.strings):
+            raise DecodeError(f"string reference {ref} outside a table of {len(self.strings)}")
+        return self.strings[ref - 1]
+
+    def read_string(self):
+        return self.string_at(self.read_int())
+
+    def read_object(self, readers):
+        # readers maps a type-signature prefix to a function reading that type's fields
+        ref = self.read_int()
+        if ref == 0:
+            return None
+        if ref < 0:
+            if -ref > len(self._seen):
+                raise DecodeError(f"back-reference {ref} to an object not yet read")
+            return self._seen[-ref - 1]
+        type_name = self.string_at(ref)
+        for prefix, reader in readers.items():
+            if type_name.startswith(prefix):
+                index = len(self._seen)
+                self._seen.append(None)
+                obj = reader(self)
+                self._seen[index] = obj
+                return obj
+        raise DecodeError(f"unexpected type {type_name} in response")
+
+
+def read_string_field(reader):
+    value = reader.read_string() or ""
+    if TYPE_SIGNATURE_RE.match(value):
+        raise DecodeError(f"type signature {value} where a string field was expected")
+    return value
+
+
+FIELD_READERS = {
+    "string": read_string_field,
+    "boolean": StreamReader.read_boolean,
+    "int": StreamReader.read_int,
+}
+
+if os.environ.get("SMARTHUB_ADDRESS_FIELDS"):
+    ADDRESS_FIELDS = parse_fields(os.environ["SMARTHUB_ADDRESS_FIELDS"])
+
+
+def read_address(reader):
+    return {name: FIELD_READERS[kind](reader) for name, kind in ADDRESS_FIELDS}
+
+
+def read_address_list(reader):
+    size = reader.read_int()
+    return [reader.read_object(ADDRESS_READERS) for _ in range(size)]
+
+
+ADDRESS_READERS = {ADDRESS_TYPE_PREFIX: read_address}
+LIST_READERS = {prefix: read_address_list for prefix in LIST_TYPE_PREFIXES}
+
+
+def decode_exception(data):
+    reader = StreamReader(data)
+    type_name = reader.string_at(reader.read_int()) if reader.remaining else None
+    message = None
+    if reader.remaining:
+        try:
+            message = reader.read_string()
+        except DecodeError:
+            pass
+    return GwtException(type_name or "unknown exception", message)
+
+
+def parse_exception(body):
+    prefix, data = parse_body(body)
+    if prefix != "//EX":
+        raise DecodeError("not an exception response")
+    return decode_exception(data)
+
+
+def decode_addresses(body):
+    # getAddressForMember -> list of address dicts; raises GwtException for //EX and DecodeError otherwise
+    prefix, data = parse_body(body)
+    if prefix == "//EX":
+        raise decode_exception(data)
+    reader = StreamReader(data)
+    addresses = reader.read_object(LIST_READERS)
+    if reader.remaining:
+        # A wrong field layout reads plausible-looking values and stops short; don't trust any of them
+        raise DecodeError(f"{reader.remaining} values left unread after the address list")
+    return [a for a in addresses or [] if a is not None]
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import os
+import secrets
+import time
+from collections import OrderedDict
+
+# Bounded in-memory store for asynchronous availability checks.
+# A job collects the stage events of its lookup so pollers get a snapshot and
+# SSE subscribers get the full history followed by live updates.
+
+JOB_STORE_SIZE = int(os.environ.get("JOB_STORE_SIZE", "1000"))
+JOB_TTL = float(os.environ.get("JOB_TTL", "600"))
+SSE_KEEPALIVE = 15.0
+
+
+class StoreFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, address):
+        self.id = secrets.token_urlsafe(12)
+        self.address = address
+        self.status = "queued"
+        self.stage = None
+        self.result = None
+        self.created = time.time()
+        self.finished_at = None
+        self.events = []
+        self._subscribers = set()
+        self._started = time.monotonic()
+
+    @property
+    def done(self):
+        return self.status == "done"
+
+    def publish(self, event, **data):
+        data["elapsed"] = round(time.monotonic() - self._started, 3)
+        entry = (event, data)
+        self.events.append(entry)
+        for queue in self._subscribers:
+            queue.put_nowait(entry)
+
+    def set_stage(self, stage):
+        self.status = "running"
+        self.stage = stage
+        self.publish("stage", stage=stage)
+
+    def finish(self, result):
+        self.status = "done"
+        self.stage = "done"
+        self.result = result
+        self.finished_at = time.monotonic()
+        self.publish("result", **result)
+
+    def snapshot(self):
+        return {
+            "job_id": self.id,
+            "address": self.address,
+            "status": self.status,
+            "stage": self.stage,
+            "created": self.created,
+            "result": self.result,
+        }
+
+    async def stream(self):
+        # Replay what already happened, then follow live events until the result is out
+        queue = asyncio.Queue()
+        self._subscribers.add(queue)
+        try:
+            for entry in list(self.events):
+                yield entry
+            if self.done:
+                return
+            while True:
+                try:
+                    entry = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield entry
+                if entry[0] == "result":
+                    return
+        finally:
+            self._subscribers.discard(queue)
+
+
+def format_sse(entry):
+    if entry is None:
+        return ": keep-alive\n\n"
+    event, data = entry
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class JobStore:
+    def __init__(self, max_jobs=JOB_STORE_SIZE, ttl=JOB_TTL):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs = OrderedDict()
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def get(self, job_id):
+        self.expire()
+        return self._jobs.get(job_id)
+
+    def create(self, address):
+        self.expire()
+        if len(self._jobs) >= self.max_jobs and not self._evict_finished():
+            raise StoreFull()
+        job = Job(address)
+        self._jobs[job.id] = job
+        return job
+
+    def expire(self):
+        # Finished jobs are kept for `ttl` seconds after completion so clients can collect the result
+        cutoff = time.monotonic() - self.ttl
+        expired = [job_id for job_id, job in self._jobs.items() if job.done and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _evict_finished(self):
+        for job_id, job in self._jobs.items():
+            if job.done:
+                del self._jobs[job_id]
+                return True
+        return False
+
+    def stats(self):
+        running = sum(1 for job in self._jobs.values() if not job.done)
+        return {"jobs": len(self._jobs), "running": running, "max_jobs": self.max_jobs}
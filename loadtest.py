@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+import httpx
+
+# Load-test harness for the availability API. Point api.py at the emulator
+# (SMARTHUB_BASE_URL=http://127.0.0.1:8006) with the per-client rate limit on /api/check
+# switched off, since every request comes from one IP:
+#   RATE_LIMITS=check=0:1 SMARTHUB_BASE_URL=http://127.0.0.1:8006 python api.py
+# and run e.g.
+#   python loadtest.py --concurrency 1,4,16,64 --requests 200 --unique
+# Alternatively pass one of RATE_LIMIT_API_KEYS with --api-key to test with the keyed allowance.
+# Each concurrency level is reported separately: throughput, latency percentiles
+# and how the failures split between HTTP statuses and lookup statuses.
+
+DEFAULT_ADDRESSES = [
+    "1900 West Oak Street, Corvallis, OR 97330",
+    "100 Main Street, Lebanon, OR 97355",
+    "250 SW Madison Avenue, Corvallis, OR 97333",
+    "3435 NE Highway 20, Corvallis, OR 97330",
+    "710 Main Street, Philomath, OR 97370",
+    "1250 Pacific Boulevard SE, Albany, OR 97321",
+    "999 Nowhere Road, Corvallis, OR 97330",
+]
+
+
+def load_addresses(path):
+    if not path:
+        return DEFAULT_ADDRESSES
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def run_level(client, url, addresses, concurrency, total, unique):
+    counter = itertools.count()
+    latencies = []
+    http_statuses = {}
+    lookup_statuses = {}
+
+    async def worker():
+        while True:
+            n = next(counter)
+            if n >= total:
+                return
+            address = addresses[n % len(addresses)]
+            if unique:
+                # Unit numbers make every request a distinct cache key but still match upstream by prefix
+                address = address.replace(",", f" Unit {n},", 1)
+            started = time.perf_counter()
+            try:
+                response = await client.get(url, params={"address": address})
+                status = str(response.status_code)
+                try:
+                    lookup = response.json().get("status", "unknown")
+                except ValueError:
+                    lookup = "invalid_json"
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+                lookup = "transport_error"
+            latencies.append(time.perf_counter() - started)
+            http_statuses[status] = http_statuses.get(status, 0) + 1
+            lookup_statuses[lookup] = lookup_statuses.get(lookup, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    errors = sum(count for status, count in http_statuses.items() if status != "200")
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 1),
+            "p95": round(percentile(latencies, 95) * 1000, 1),
+            "p99": round(percentile(latencies, 99) * 1000, 1),
+            "max": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        },
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "http_status": http_statuses,
+        "lookup_status": lookup_statuses,
+    }
+
+
+def print_report(result):
+    lat = result["latency_ms"]
+    print(f"concurrency={result['concurrency']:<4} requests={result['requests']:<6} "
+          f"rps={result['throughput_rps']:<8} p50={lat['p50']}ms p95={lat['p95']}ms "
+          f"p99={lat['p99']}ms max={lat['max']}ms errors={result['error_rate']:.2%}")
+    print(f"    http: {result['http_status']}  lookup: {result['lookup_status']}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load-test the availability API")
+    parser.add_argument("--url", default="http://127.0.0.1:8005", help="Base URL of api.py")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per concurrency level")
+    parser.add_argument("--addresses", help="File with one address per line (defaults to the emulator's)")
+    parser.add_argument("--unique", action="store_true", help="Make every address unique to bypass the cache")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    parser.add_argument("--api-key", help="Sent as X-API-Key, for the larger rate limit of a known key")
+    args = parser.parse_args()
+
+    addresses = load_addresses(args.addresses)
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    url = args.url.rstrip("/") + "/api/check"
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+
+    results = []
+    headers = {"X-API-Key": args.api_key} if args.api_key else None
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits, headers=headers) as client:
+        for concurrency in levels:
+            result = await run_level(client, url, addresses, concurrency, args.requests, args.unique)
+            print_report(result)
+            results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
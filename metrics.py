@@ -0,0 +1,154 @@
+import bisect
+import math
+import threading
+
+# Minimal Prometheus text-format metrics for the availability service.
+# Updates are a dict lookup plus an add, so they are cheap enough to leave on in production.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0)
+
+
+def format_labels(labelnames, labels, extra=()):
+    pairs = list(zip(labelnames, labels)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # Re-registering a name replaces it, so callbacks can be rebound on restart
+            self._metrics = [m for m in self._metrics if m.name != metric.name]
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in list(self._metrics):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        registry.register(self)
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        for labels, value in sorted(self._values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+
+class CallbackMetric:
+    # Value is read from the live object at scrape time, e.g. pool size or cache counters
+    def __init__(self, name, help, fn, kind="gauge", registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.kind = kind
+        registry.register(self)
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            return
+        if value is not None:
+            yield f"{self.name} {format_value(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._series = {}
+        registry.register(self)
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def samples(self):
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), series[:-1]):
+                cumulative += count
+                le = format_labels(self.labelnames, labels, [("le", format_value(float(bound)))])
+                yield f"{self.name}_bucket{le} {cumulative}"
+            label_str = format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_str} {format_value(series[-1])}"
+            yield f"{self.name}_count{label_str} {cumulative}"
+
+
+CHECK_REQUESTS = Counter(
+    "peak_check_requests_total",
+    "Availability checks by outcome (success, not_verified, timeout, error, rejected).",
+    ["outcome"],
+)
+CHECK_SECONDS = Histogram(
+    "peak_check_duration_seconds",
+    "End-to-end availability check latency, including cache hits.",
+)
+LOOKUP_PATHS = Counter(
+    "peak_lookup_path_total",
+    "Where each check was answered from (cache, rpc, browser).",
+    ["path"],
+)
+STAGE_SECONDS = Histogram(
+    "peak_lookup_stage_seconds",
+    "Time spent in each stage of an upstream lookup.",
+    ["stage"],
+)
+BROWSER_RESTARTS = Counter(
+    "peak_browser_restarts_total",
+    "Number of times the shared Chromium has been relaunched, by reason.",
+    ["reason"],
+)
@@ -0,0 +1,188 @@
+import asyncio
+import contextlib
+import logging
+import os
+import time
+
+import metrics
+import tracing
+
+# Pool of pre-navigated Shop.html pages so a lookup only pays for the form submit,
+# not for the GWT bootstrap. Pages are reset in place between leases and replaced
+# whenever they fail a health check.
+
+log = logging.getLogger(__name__)
+
+PAGE_POOL_SIZE = int(os.environ.get("PAGE_POOL_SIZE", "4"))
+
+SUGGEST_BOX_SELECTOR = "input.gwt-SuggestBox.form-control"
+
+HEALTH_CHECK_JS = '''() => {
+    return document.querySelectorAll('select').length > 0 && !!document.querySelector('input.gwt-SuggestBox');
+}'''
+
+# Put the form back to its freshly-loaded state without reloading the GWT module
+RESET_FORM_JS = '''() => {
+    const selects = document.querySelectorAll('select');
+    selects.forEach(s => {
+        if (s.selectedIndex !== 0) {
+            s.selectedIndex = 0;
+            s.dispatchEvent(new Event('change', { bubbles: true }));
+        }
+    });
+    const input = document.querySelector('input.gwt-SuggestBox');
+    if (input) {
+        input.value = '';
+        input.dispatchEvent(new Event('input', { bubbles: true }));
+    }
+    return selects.length > 0 && !!input;
+}'''
+
+
+class PoolClosed(Exception):
+    # The pool was retired (browser recycled or shutting down) while a caller waited for a page
+    pass
+
+
+class PagePool:
+    def __init__(self, browser, url, size=PAGE_POOL_SIZE, setup_page=None, settle_timeout=35000):
+        self.browser = browser
+        self.url = url
+        self.size = size
+        self.setup_page = setup_page
+        self.settle_timeout = settle_timeout
+        self._idle = asyncio.Queue()
+        self._pages = set()
+        self._replacements = set()
+        self._closed = False
+        self.created = 0
+        self.replaced = 0
+        self.leases = 0
+        self.in_use = 0
+
+    @property
+    def open_pages(self):
+        return len(self._pages)
+
+    @property
+    def idle_pages(self):
+        return self._idle.qsize()
+
+    async def start(self):
+        results = await asyncio.gather(*(self._open_page() for _ in range(self.size)), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                log.warning("Failed to warm pool page, retrying in background: %s", result)
+                self._spawn_replacement()
+            else:
+                self._idle.put_nowait(result)
+        log.info("Page pool warmed with %s/%s Shop.html pages.", self._idle.qsize(), self.size)
+
+    async def drain(self, timeout):
+        # Wait for every leased page to come back, so in-flight lookups finish on this pool
+        deadline = time.monotonic() + timeout
+        while self.in_use and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        return self.in_use == 0
+
+    async def close(self):
+        self._closed = True
+        for task in list(self._replacements):
+            task.cancel()
+        # Wake anyone still waiting for a page; each waiter passes the sentinel on to the next
+        self._idle.put_nowait(None)
+        for page in list(self._pages):
+            await self._discard(page)
+
+    async def _open_page(self):
+        page = await self.browser.new_page()
+        self._pages.add(page)
+        try:
+            if self.setup_page:
+                await self.setup_page(page)
+            start = time.perf_counter()
+            with tracing.span("goto"):
+                await page.goto(self.url, wait_until="domcontentloaded")
+                # The page is usable once GWT has rendered the street suggest box
+                await page.wait_for_selector(SUGGEST_BOX_SELECTOR, state="attached", timeout=self.settle_timeout)
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - start, "goto")
+        except Exception:
+            await self._discard(page)
+            raise
+        self.created += 1
+        return page
+
+    async def _discard(self, page):
+        self._pages.discard(page)
+        try:
+            await page.close()
+        except Exception:
+            pass
+
+    async def _is_healthy(self, page):
+        if page.is_closed():
+            return False
+        try:
+            return bool(await page.evaluate(HEALTH_CHECK_JS))
+        except Exception:
+            return False
+
+    async def _reset(self, page):
+        if page.is_closed():
+            return False
+        try:
+            return bool(await page.evaluate(RESET_FORM_JS))
+        except Exception:
+            return False
+
+    async def _replace(self):
+        # Keep trying until the pool is back to full strength or shut down
+        while not self._closed:
+            try:
+                page = await self._open_page()
+            except Exception as e:
+                log.warning("Failed to open replacement pool page: %s", e)
+                await asyncio.sleep(5)
+                continue
+            self.replaced += 1
+            self._idle.put_nowait(page)
+            return
+
+    def _spawn_replacement(self):
+        if self._closed:
+            return
+        task = asyncio.create_task(self._replace())
+        self._replacements.add(task)
+        task.add_done_callback(self._replacements.discard)
+
+    @contextlib.asynccontextmanager
+    async def lease(self):
+        page = await self._idle.get()
+        if page is None or self._closed:
+            self._idle.put_nowait(None)
+            if page is not None:
+                await self._discard(page)
+            raise PoolClosed()
+        if not await self._is_healthy(page):
+            log.warning("Pool page failed health check, replacing it.")
+            await self._discard(page)
+            try:
+                page = await self._open_page()
+            except Exception:
+                self._spawn_replacement()
+                raise
+            self.replaced += 1
+
+        self.leases += 1
+        self.in_use += 1
+        reusable = False
+        try:
+            yield page
+            reusable = await self._reset(page)
+        finally:
+            self.in_use -= 1
+            if reusable and not self._closed:
+                self._idle.put_nowait(page)
+            else:
+                await self._discard(page)
+                self._spawn_replacement()
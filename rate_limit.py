@@ -0,0 +1,146 @@
+import ipaddress
+import logging
+import math
+import os
+import time
+
+import metrics
+
+# Per-client token buckets so one looping client can't hold every browser page.
+# Each route has its own rate (tokens per second) and burst. A bucket is two numbers
+# updated in O(1) per request; buckets that have refilled completely are identical to a
+# fresh one, so the periodic sweep drops them without changing anyone's allowance.
+# Clients are keyed by IP, or by API key when they present one we know, which gets a
+# larger allowance.
+
+log = logging.getLogger(__name__)
+
+# route -> (tokens per second, burst)
+RATE_LIMIT_DEFAULTS = {
+    "check": (1.0, 10),
+    "batch": (0.05, 2),
+    "jobs": (1.0, 10),
+    "suggest": (20.0, 40),
+}
+# e.g. "check=2:20,suggest=50:100"
+RATE_LIMITS = os.environ.get("RATE_LIMITS", "")
+RATE_LIMIT_API_KEYS = {k.strip() for k in os.environ.get("RATE_LIMIT_API_KEYS", "").split(",") if k.strip()}
+RATE_LIMIT_API_KEY_MULTIPLIER = float(os.environ.get("RATE_LIMIT_API_KEY_MULTIPLIER", "10"))
+# Only honour X-Forwarded-For when a proxy we control sets it; the proxy's own entry is the last one
+RATE_LIMIT_TRUST_PROXY = os.environ.get("RATE_LIMIT_TRUST_PROXY", "0") == "1"
+RATE_LIMIT_SWEEP_INTERVAL = 60.0
+
+RATE_LIMITED = metrics.Counter(
+    "peak_rate_limited_total",
+    "Requests refused with 429, by route.",
+    ["route"],
+)
+
+
+def parse_limits(spec, defaults=RATE_LIMIT_DEFAULTS):
+    limits = dict(defaults)
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        try:
+            route, value = entry.split("=", 1)
+            rate, burst = value.split(":", 1)
+            limits[route.strip()] = (float(rate), float(burst))
+        except ValueError:
+            log.warning("Ignoring malformed RATE_LIMITS entry %r, expected route=rate:burst", entry)
+    return limits
+
+
+def is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+class TokenBuckets:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        # key -> [tokens, last refill time]
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, now, scale=1.0):
+        # Returns 0 when allowed, otherwise the seconds until a token will be available
+        rate, burst = self.rate * scale, self.burst * scale
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = [burst - 1, now]
+            return 0.0
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0.0
+        bucket[0] = tokens
+        return (1 - tokens) / rate
+
+    def sweep(self, now):
+        # A bucket idle for burst/rate seconds is full again, same as having none
+        full_after = self.burst / self.rate if self.rate > 0 else math.inf
+        idle = [key for key, (_, last) in self._buckets.items() if now - last >= full_after]
+        for key in idle:
+            del self._buckets[key]
+        return len(idle)
+
+
+class RateLimiter:
+    def __init__(self, limits=None, api_keys=RATE_LIMIT_API_KEYS, api_key_multiplier=RATE_LIMIT_API_KEY_MULTIPLIER,
+                 trust_proxy=RATE_LIMIT_TRUST_PROXY, sweep_interval=RATE_LIMIT_SWEEP_INTERVAL):
+        limits = limits if limits is not None else parse_limits(RATE_LIMITS)
+        self.routes = {route: TokenBuckets(rate, burst) for route, (rate, burst) in limits.items()}
+        self.api_keys = api_keys
+        self.api_key_multiplier = api_key_multiplier
+        self.trust_proxy = trust_proxy
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+        self.evicted = 0
+        self._proxy_warned = False
+
+    def client_key(self, request):
+        api_key = request.headers.get("x-api-key")
+        if api_key and api_key in self.api_keys:
+            return "key:" + api_key, self.api_key_multiplier
+        if self.trust_proxy:
+            forwarded = request.headers.get("x-forwarded-for")
+            if forwarded:
+                # Entries to the left are whatever the client sent and can be rotated freely;
+                # the right-most one was appended by our proxy from the connecting address
+                return "ip:" + forwarded.split(",")[-1].strip(), 1.0
+        host = request.client.host if request.client else "unknown"
+        if not self._proxy_warned and "x-forwarded-for" in request.headers and is_loopback(host):
+            # api.py binds 127.0.0.1, so without proxy trust every visitor lands in the proxy's bucket
+            self._proxy_warned = True
+            log.warning(
+                "Proxied request from %s but RATE_LIMIT_TRUST_PROXY is off: all clients share one rate-limit "
+                "bucket. Set RATE_LIMIT_TRUST_PROXY=1 when the API sits behind a reverse proxy.", host,
+            )
+        return "ip:" + host, 1.0
+
+    def check(self, route, request):
+        buckets = self.routes.get(route)
+        if buckets is None or buckets.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        if now - self._last_sweep >= self.sweep_interval:
+            self._last_sweep = now
+            self.evicted += sum(b.sweep(now) for b in self.routes.values())
+        key, scale = self.client_key(request)
+        retry_after = buckets.take(key, now, scale)
+        if retry_after:
+            RATE_LIMITED.inc(route)
+        return retry_after
+
+    def stats(self):
+        return {
+            "routes": {route: {"rate": b.rate, "burst": b.burst, "clients": len(b)} for route, b in self.routes.items()},
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,150 @@
+import logging
+import os
+import weakref
+
+# Request routing policy for the headless SmartHub pages.
+# Non-essential sub-resources are blocked inside Chromium with Network.setBlockedURLs,
+# so they never make a CDP round-trip to Python. MemberService calls are routed through
+# a Python handler, and so are the remaining static SmartHub files when an AssetCache is
+# given, which replays them from disk instead of downloading them again.
+
+log = logging.getLogger(__name__)
+
+MEMBER_SERVICE_PATTERN = "**/gwt/MemberService*"
+
+# URL patterns per resource type; setBlockedURLs matches on URL, not on resource type
+TYPE_PATTERNS = {
+    "image": ["*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*", "*.svg*", "*.ico*"],
+    "font": ["*.woff*", "*.ttf*", "*.otf*", "*.eot*"],
+    "media": ["*.mp4*", "*.webm*", "*.mp3*", "*.ogg*"],
+    "stylesheet": ["*.css*"],
+}
+
+DEFAULT_BLOCK_HOSTS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "facebook.net",
+    "hotjar.com",
+    "fonts.googleapis.com",
+    "fonts.gstatic.com",
+]
+
+# Stylesheets stay allowed by default: GWT/Bootstrap visibility classes decide which Go buttons are clickable
+ROUTE_BLOCK_TYPES = os.environ.get("ROUTE_BLOCK_TYPES", "image,font,media")
+ROUTE_BLOCK_HOSTS = os.environ.get("ROUTE_BLOCK_HOSTS", ",".join(DEFAULT_BLOCK_HOSTS))
+
+# Blocked requests are never downloaded, so savings are estimated from typical sizes per CDP resource type
+NOMINAL_BYTES = {
+    "Image": 25000,
+    "Font": 40000,
+    "Media": 250000,
+    "Stylesheet": 30000,
+    "Script": 50000,
+    "Ping": 500,
+}
+
+
+def split_setting(value):
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+class RoutingPolicy:
+    def __init__(self, block_types=None, block_hosts=None):
+        self.block_types = split_setting(ROUTE_BLOCK_TYPES) if block_types is None else block_types
+        self.block_hosts = split_setting(ROUTE_BLOCK_HOSTS) if block_hosts is None else block_hosts
+
+    def blocked_url_patterns(self):
+        patterns = []
+        for resource_type in self.block_types:
+            patterns += TYPE_PATTERNS.get(resource_type, [])
+        for host in self.block_hosts:
+            patterns += [f"*://{host}/*", f"*://*.{host}/*"]
+        return patterns
+
+
+class RouteStats:
+    def __init__(self):
+        self.blocked_requests = 0
+        self.estimated_bytes_saved = 0
+        self.finished_requests = 0
+        self.bytes_transferred = 0
+        self.member_service_calls = 0
+        self.cached_requests = 0
+        self.cached_bytes = 0
+
+    def snapshot(self):
+        return dict(vars(self))
+
+    def since(self, snapshot):
+        return {k: v - snapshot.get(k, 0) for k, v in vars(self).items()}
+
+
+# Per-page counters; entries go away with the page
+_page_stats = weakref.WeakKeyDictionary()
+
+
+def stats_for(page):
+    return _page_stats.get(page)
+
+
+async def on_member_service(route, request):
+    stats = _page_stats.get(request.frame.page)
+    if stats:
+        stats.member_service_calls += 1
+    await route.continue_()
+
+
+async def install(page, policy, asset_cache=None):
+    stats = RouteStats()
+    _page_stats[page] = stats
+
+    try:
+        cdp = await page.context.new_cdp_session(page)
+        await cdp.send("Network.enable")
+        await cdp.send("Network.setBlockedURLs", {"urls": policy.blocked_url_patterns()})
+    except Exception as e:
+        # Not Chromium, or CDP unavailable: lookups still work, just without blocking
+        log.warning("Resource blocking unavailable for this page: %s", e)
+        cdp = None
+
+    if cdp:
+        request_types = {}
+
+        def on_request(event):
+            request_types[event["requestId"]] = event.get("type", "Other")
+
+        def on_failed(event):
+            resource_type = request_types.pop(event["requestId"], event.get("type", "Other"))
+            if event.get("blockedReason"):
+                stats.blocked_requests += 1
+                stats.estimated_bytes_saved += NOMINAL_BYTES.get(resource_type, 5000)
+
+        def on_finished(event):
+            request_types.pop(event["requestId"], None)
+            stats.finished_requests += 1
+            stats.bytes_transferred += int(event.get("encodedDataLength", 0))
+
+        cdp.on("Network.requestWillBeSent", on_request)
+        cdp.on("Network.loadingFailed", on_failed)
+        cdp.on("Network.loadingFinished", on_finished)
+
+    if asset_cache is None:
+        # Only the MemberService calls come through Python
+        await page.route(MEMBER_SERVICE_PATTERN, on_member_service)
+        return stats
+
+    async def on_asset(route, request):
+        replayed = await asset_cache.handle(route, request)
+        if replayed:
+            stats.cached_requests += 1
+            stats.cached_bytes += replayed
+
+    async def on_member_service_call(route, request):
+        # The permutation the page is running tells the cache whether its stored assets are current
+        asset_cache.observe_permutation(request.headers.get("x-gwt-permutation"))
+        await on_member_service(route, request)
+
+    await page.route(asset_cache.matches, on_asset)
+    await page.route(MEMBER_SERVICE_PATTERN, on_member_service_call)
+    return stats
@@ -0,0 +1,227 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from runtime_paths import VAR_DIR, ensure_parent
+
+# On-disk availability results shared by every uvicorn worker on the host. SQLite in WAL
+# mode lets all workers read while one writes, so a warm cache survives deploys and each
+# new worker starts with everything the others have learned. Reads are single primary-key
+# lookups done inline; writes are buffered and committed in batches off the event loop,
+# and a periodic compaction drops rows too old to be worth serving even as stale answers.
+
+log = logging.getLogger(__name__)
+
+AVAILABILITY_DB = os.environ.get("AVAILABILITY_DB", os.path.join(VAR_DIR, "availability.db"))
+STORE_FLUSH_INTERVAL = float(os.environ.get("AVAILABILITY_DB_FLUSH_INTERVAL", "0.5"))
+STORE_BATCH_SIZE = int(os.environ.get("AVAILABILITY_DB_BATCH_SIZE", "200"))
+STORE_COMPACT_INTERVAL = float(os.environ.get("AVAILABILITY_DB_COMPACT_INTERVAL", "3600"))
+# Expired rows are kept this long past their TTL as stale fallbacks for circuit-open periods
+STORE_STALE_RETENTION = float(os.environ.get("AVAILABILITY_DB_STALE_RETENTION", str(7 * 86400)))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    outcome TEXT NOT NULL,
+    result TEXT NOT NULL,
+    stored_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_expires_at ON results (expires_at);
+"""
+
+UPSERT = """
+INSERT INTO results (key, outcome, result, stored_at, expires_at) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET
+    outcome = excluded.outcome, result = excluded.result,
+    stored_at = excluded.stored_at, expires_at = excluded.expires_at
+"""
+
+
+def encode_key(key):
+    return json.dumps(key, separators=(",", ":"))
+
+
+def connect(path):
+    conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL plus NORMAL only risks the last few commits on power loss, which a cache can afford
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+class ResultStore:
+    def __init__(self, path=AVAILABILITY_DB, flush_interval=STORE_FLUSH_INTERVAL, batch_size=STORE_BATCH_SIZE,
+                 compact_interval=STORE_COMPACT_INTERVAL, stale_retention=STORE_STALE_RETENTION):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.compact_interval = compact_interval
+        self.stale_retention = stale_retention
+        self._reader = None
+        self._writer = None
+        # key -> row waiting for the next batch; reads check here first so a worker sees its own writes
+        self._pending = {}
+        self._flush_wanted = asyncio.Event()
+        self._task = None
+        self._last_compact = time.monotonic()
+        self.reads = 0
+        self.hits = 0
+        self.writes = 0
+        self.flushes = 0
+        self.compacted = 0
+        self.errors = 0
+
+    @property
+    def available(self):
+        return self._reader is not None
+
+    def start(self):
+        try:
+            ensure_parent(self.path)
+            self._writer = connect(self.path)
+            self._writer.executescript(SCHEMA)
+            self._reader = connect(self.path)
+        except (OSError, sqlite3.Error) as e:
+            log.error("Availability store %s unavailable, using the in-memory cache only: %s", self.path, e)
+            self._reader = self._writer = None
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._writer:
+            await self.flush()
+            self._writer.close()
+            self._reader.close()
+            self._reader = self._writer = None
+
+    def get(self, key):
+        # (result, expires_at wall time) or None
+        if not self.available:
+            return None
+        encoded = encode_key(key)
+        row = self._pending.get(encoded)
+        if row is None:
+            self.reads += 1
+            try:
+                row = self._reader.execute(
+                    "SELECT key, outcome, result, stored_at, expires_at FROM results WHERE key = ?", (encoded,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                self.errors += 1
+                log.warning("Availability store read failed: %s", e)
+                return None
+            if row is None:
+                return None
+        self.hits += 1
+        return json.loads(row[2]), row[4]
+
+    def put(self, key, outcome, result, ttl):
+        if not self.available:
+            return
+        now = time.time()
+        encoded = encode_key(key)
+        self._pending[encoded] = (encoded, outcome, json.dumps(result), now, now + ttl)
+        if len(self._pending) >= self.batch_size:
+            self._flush_wanted.set()
+
+    def _write_batch(self, rows):
+        self._writer.execute("BEGIN IMMEDIATE")
+        try:
+            self._writer.executemany(UPSERT, rows)
+            self._writer.execute("COMMIT")
+        except BaseException:
+            self._writer.execute("ROLLBACK")
+            raise
+
+    async def flush(self):
+        if not self._pending or not self._writer:
+            return
+        rows = list(self._pending.values())
+        try:
+            await asyncio.to_thread(self._write_batch, rows)
+        except sqlite3.Error as e:
+            self.errors += 1
+            log.warning("Availability store write of %s rows failed: %s", len(rows), e)
+            return
+        # Rows put again while the batch was being written stay pending with their newer values
+        for row in rows:
+            if self._pending.get(row[0]) is row:
+                del self._pending[row[0]]
+        self.writes += len(rows)
+        self.flushes += 1
+
+    def _compact(self):
+        cutoff = time.time() - self.stale_retention
+        deleted = self._writer.execute("DELETE FROM results WHERE expires_at < ?", (cutoff,)).rowcount
+        # Fold the WAL back into the main file so it doesn't grow between checkpoints
+        self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        if deleted:
+            self._writer.execute("PRAGMA optimize")
+        return deleted
+
+    async def compact(self):
+        try:
+            deleted = await asyncio.to_thread(self._compact)
+        except sqlite3.Error as e:
+            self.errors += 1
+            log.warning("Availability store compaction failed: %s", e)
+            return 0
+        self.compacted += deleted
+        self._last_compact = time.monotonic()
+        return deleted
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_wanted.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_wanted.clear()
+            await self.flush()
+            if time.monotonic() - self._last_compact >= self.compact_interval:
+                await self.compact()
+
+    def verified_keys(self):
+        # Keys SmartHub has confirmed, for seeding the address suggestions at startup
+        if not self.available:
+            return []
+        try:
+            rows = self._reader.execute("SELECT key FROM results WHERE outcome = 'success'").fetchall()
+        except sqlite3.Error as e:
+            self.errors += 1
+            log.warning("Availability store read failed: %s", e)
+            return []
+        return [tuple(json.loads(row[0])) for row in rows]
+
+    def row_count(self):
+        if not self.available:
+            return 0
+        try:
+            return self._reader.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        except sqlite3.Error:
+            return None
+
+    def stats(self):
+        return {
+            "path": self.path,
+            "available": self.available,
+            "rows": self.row_count(),
+            "pending": len(self._pending),
+            "reads": self.reads,
+            "hits": self.hits,
+            "writes": self.writes,
+            "flushes": self.flushes,
+            "compacted": self.compacted,
+            "errors": self.errors,
+        }
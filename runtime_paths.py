@@ -0,0 +1,13 @@
+import os
+
+# Where the API keeps state it writes at runtime: the availability store, trace files and
+# the SmartHub asset cache. It sits beside the site but outside what StaticFiles serves,
+# and api.py excludes it (and any overridden path) from the static mount as well.
+
+VAR_DIR = os.environ.get("PEAK_VAR_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "var"))
+
+
+def ensure_parent(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    return directory
@@ -1,91 +1,263 @@
 import asyncio
 import json
 import logging
-from playwright.async_api import async_playwright
+import os
+import tempfile
+import time
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+from smarthub_rpc import SCRAPE_PROBE_STREET, SMARTHUB_BASE_URL, TOKEN_FILE, make_payload_template
+import metrics
+from runtime_paths import VAR_DIR, ensure_parent
+import structured_log
 
-TOKEN_FILE = "smarthub_tokens.json"
+log = logging.getLogger(__name__)
 
-async def scrape_tokens():
-    logging.info("Starting background token scraper...")
+# Raw getAddressForMember response from the last scrape, kept for checking gwt_decoder's Address layout
+MEMBER_SERVICE_SAMPLE = os.environ.get("MEMBER_SERVICE_SAMPLE", os.path.join(VAR_DIR, "member_service_sample.txt"))
+
+# How often the API re-scrapes on its own, and the floor between scrapes triggered by rejected tokens
+TOKEN_REFRESH_INTERVAL = float(os.environ.get("TOKEN_REFRESH_INTERVAL", "1800"))
+TOKEN_REFRESH_MIN_INTERVAL = float(os.environ.get("TOKEN_REFRESH_MIN_INTERVAL", "60"))
+
+TOKEN_REFRESHES = metrics.Counter(
+    "peak_token_refreshes_total",
+    "SmartHub token scrapes run by the API, by result.",
+    ["result"],
+)
+
+def save_tokens(tokens, token_file=TOKEN_FILE):
+    # Write to a temp file in the same directory and rename over the old one,
+    # so readers only ever see a complete token file
+    directory = os.path.dirname(os.path.abspath(token_file))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".smarthub_tokens.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(tokens, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, token_file)
+    except Exception:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def save_sample(body, path=MEMBER_SERVICE_SAMPLE):
+    ensure_parent(path)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(body)
+
+async def scrape_tokens(browser=None, token_file=TOKEN_FILE):
+    # Reuse the caller's browser when given one (the API does), otherwise launch our own
+    if browser is not None:
+        return await scrape_with_browser(browser, token_file)
+
+    from playwright.async_api import async_playwright
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True)
+        try:
+            return await scrape_with_browser(browser, token_file)
+        finally:
+            await browser.close()
+
+async def scrape_with_browser(browser, token_file=TOKEN_FILE):
+    log.info("Starting background token scraper...")
     tokens = {
         "jsessionid": None,
         "xsrf_token": None,
         "permutation": None,
         "rpc_hash": None,
     }
-    
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        page = await browser.new_page()
-        
-        async def handle_request(route, request):
-            if request.method == "POST" and "gwt/MemberService" in request.url:
-                # payload looks like: 7|0|4|https://peak.smarthub.coop/|B594...|coop...|getAddressForMember|1|2|3|4|0|
-                post_data = request.post_data
-                if post_data and "getAddressForMember" in post_data:
-                    parts = post_data.split('|')
-                    if len(parts) > 5:
-                        tokens["rpc_hash"] = parts[4]
-                        logging.info(f"Captured RPC Hash: {tokens['rpc_hash']}")
-                
-                # capture headers
-                headers = request.headers
-                if 'x-gwt-permutation' in headers:
-                    tokens["permutation"] = headers['x-gwt-permutation']
-                    logging.info(f"Captured Permutation: {tokens['permutation']}")
-                    
-            await route.continue_()
-
-        await page.route("**/*", handle_request)
-        
+    # Optional extras that let api.py replay the call exactly; not required for a successful scrape
+    rpc_details = {}
+
+    # new_page() on a Browser gets its own context, so this session never touches the pooled pages
+    page = await browser.new_page()
+
+    async def handle_request(route, request):
+        if request.method == "POST" and "gwt/MemberService" in request.url:
+            # payload looks like: 7|0|4|https://peak.smarthub.coop/|B594...|coop...|getAddressForMember|1|2|3|4|0|
+            post_data = request.post_data
+            if post_data and "getAddressForMember" in post_data:
+                parts = post_data.split('|')
+                if len(parts) > 5:
+                    tokens["rpc_hash"] = parts[4]
+                    rpc_details["module_base"] = parts[3]
+                    rpc_details["service_interface"] = parts[5]
+                    rpc_details["rpc_url"] = request.url
+                    log.info("Captured RPC Hash: %s", tokens["rpc_hash"])
+                    # The body is replayed as recorded; the probe street marks where a search goes
+                    template = make_payload_template(post_data)
+                    if template:
+                        rpc_details["payload_template"] = template
+                    elif "payload_template" not in rpc_details:
+                        log.warning("getAddressForMember call did not carry the probe street: %s", post_data[:300])
+
+            # capture headers
+            headers = request.headers
+            if 'x-gwt-permutation' in headers:
+                tokens["permutation"] = headers['x-gwt-permutation']
+                log.info("Captured Permutation: %s", tokens["permutation"])
+
+        await route.continue_()
+
+    async def handle_response(response):
+        if response.request.method == "POST" and "gwt/MemberService" in response.url:
+            try:
+                body = await response.text()
+                await asyncio.to_thread(save_sample, body)
+                log.info("Saved a MemberService response sample to %s", MEMBER_SERVICE_SAMPLE)
+            except Exception as e:
+                log.warning("Could not save the MemberService response sample: %s", e)
+
+    await page.route("**/*", handle_request)
+    page.on("response", handle_response)
+
+    try:
+        log.info("Navigating to Shop.html to generate tokens...")
+        await page.goto(f"{SMARTHUB_BASE_URL}/Shop.html", wait_until="domcontentloaded")
+        await page.wait_for_selector("text=Street Address", timeout=35000)
+
+        # Extract cookies
+        context = page.context
+        cookies = await context.cookies()
+        for cookie in cookies:
+            if cookie['name'] == 'JSESSIONID-consumer_1.0':
+                tokens["jsessionid"] = cookie['value']
+            elif cookie['name'] == 'XSRF-TOKEN':
+                tokens["xsrf_token"] = cookie['value']
+
+        log.info("Captured Cookies: JSESSION=%s, XSRF=%s", tokens["jsessionid"], tokens["xsrf_token"])
+
+        # Trigger a dummy request to capture the RPC hash by just filling the street box and hitting Enter
+        # The API will complain but it still sends the payload with the RPC Hash
+        await asyncio.sleep(1)
+        street_input = page.locator("input.gwt-SuggestBox.form-control").first
+        await street_input.fill(SCRAPE_PROBE_STREET, force=True, timeout=10000)
+        await street_input.press("Enter")
+        await street_input.press("Tab")
+        await asyncio.sleep(1)
+
         try:
-            logging.info("Navigating to Shop.html to generate tokens...")
-            await page.goto("https://peak.smarthub.coop/Shop.html", wait_until="domcontentloaded")
-            await page.wait_for_selector("text=Street Address", timeout=35000)
-            
-            # Extract cookies
-            context = page.context
-            cookies = await context.cookies()
-            for cookie in cookies:
-                if cookie['name'] == 'JSESSIONID-consumer_1.0':
-                    tokens["jsessionid"] = cookie['value']
-                elif cookie['name'] == 'XSRF-TOKEN':
-                    tokens["xsrf_token"] = cookie['value']
-            
-            logging.info(f"Captured Cookies: JSESSION={tokens['jsessionid']}, XSRF={tokens['xsrf_token']}")
-            
-            # Trigger a dummy request to capture the RPC hash by just filling the street box and hitting Enter
-            # The API will complain but it still sends the payload with the RPC Hash
-            await asyncio.sleep(1)
-            street_input = page.locator("input.gwt-SuggestBox.form-control").first
-            await street_input.fill("100 Main St", force=True, timeout=10000)
-            await street_input.press("Enter")
-            await street_input.press("Tab")
-            await asyncio.sleep(1)
-            
+            go_button = page.locator("button.btn-primary:has-text('Go!')").first
+            await go_button.click(force=True, timeout=5000)
+        except:
+            log.error("Could not find Go button")
+
+        # Wait for the network request to be captured
+        await asyncio.sleep(4)
+
+        # Validate and save
+        if all(tokens.values()):
+            saved = {**tokens, **rpc_details}
+            # fsync can stall for a while; the API's lookups keep running meanwhile
+            await asyncio.to_thread(save_tokens, saved, token_file)
+            log.info("Successfully saved tokens to %s", token_file)
+            return saved
+        else:
+            log.error("Failed to capture all tokens: %s", dict(tokens))
+
+    except Exception as e:
+        log.error("Error scraping tokens: %s", e)
+    finally:
+        await page.close()
+    return None
+
+class TokenRefresher:
+    # Background task inside the API process that keeps rpc_client's tokens fresh.
+    # It re-scrapes on a schedule or as soon as a lookup reports the tokens were rejected,
+    # and reloads the token file whenever something else (e.g. a manual scraper.py run) rewrites it.
+    def __init__(self, rpc_client, get_browser, interval=TOKEN_REFRESH_INTERVAL,
+                 min_interval=TOKEN_REFRESH_MIN_INTERVAL, retry_interval=300, poll_interval=5):
+        self.rpc_client = rpc_client
+        self.get_browser = get_browser
+        self.interval = interval
+        self.min_interval = min_interval
+        self.retry_interval = retry_interval
+        self.poll_interval = poll_interval
+        self._wake = asyncio.Event()
+        self._task = None
+        self._last_attempt = float("-inf")
+        self._file_mtime = self._token_file_mtime()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
             try:
-                go_button = page.locator("button.btn-primary:has-text('Go!')").first
-                await go_button.click(force=True, timeout=5000)
-            except:
-                logging.error("Could not find Go button")
-            
-            # Wait for the network request to be captured
-            await asyncio.sleep(4)
-            
-            # Validate and save
-            if all(tokens.values()):
-                with open(TOKEN_FILE, "w", encoding="utf-8") as f:
-                    json.dump(tokens, f)
-                logging.info(f"Successfully saved tokens to {TOKEN_FILE}")
-            else:
-                logging.error(f"Failed to capture all tokens: {tokens}")
-                
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def request_refresh(self):
+        self._wake.set()
+
+    def _token_file_mtime(self):
+        try:
+            return os.stat(self.rpc_client.token_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload_if_changed(self):
+        mtime = self._token_file_mtime()
+        if mtime is not None and mtime != self._file_mtime:
+            self._file_mtime = mtime
+            if self.rpc_client.load_tokens():
+                log.info("Reloaded SmartHub tokens from disk")
+
+    async def refresh(self):
+        # True/False for a scrape that succeeded/failed, None when there was no browser to scrape with
+        browser = self.get_browser()
+        if browser is None:
+            TOKEN_REFRESHES.inc("skipped")
+            return None
+        self._last_attempt = time.monotonic()
+        try:
+            tokens = await scrape_tokens(browser, self.rpc_client.token_file)
         except Exception as e:
-            logging.error(f"Error scraping tokens: {e}")
-        finally:
-            await browser.close()
+            log.error("Token refresh failed: %s", e)
+            tokens = None
+        if not tokens:
+            TOKEN_REFRESHES.inc("failure")
+            return False
+        # Single attribute swap; in-flight calls keep the snapshot they already took
+        self.rpc_client.set_tokens(tokens)
+        self._file_mtime = self._token_file_mtime()
+        TOKEN_REFRESHES.inc("success")
+        return True
+
+    async def _run(self):
+        # Tokens without a request template are as good as none for the fast path
+        due = time.monotonic() + (self.interval if self.rpc_client.available else 0)
+        while True:
+            wait = min(self.poll_interval, max(0.0, due - time.monotonic()))
+            try:
+                await asyncio.wait_for(self._wake.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            if self._wake.is_set():
+                self._wake.clear()
+                # A rejection pulls the next scrape forward, but never closer than min_interval to the last one
+                due = min(due, self._last_attempt + self.min_interval)
+
+            self.reload_if_changed()
+            if time.monotonic() < due:
+                continue
+            try:
+                ok = await self.refresh()
+            except Exception as e:
+                log.exception("Token refresher error: %s", e)
+                ok = False
+            if ok is None:
+                # Browser still warming up: try again as soon as it is there, not a retry_interval later
+                due = time.monotonic() + self.poll_interval
+            else:
+                due = time.monotonic() + (self.interval if ok else self.retry_interval)
 
 if __name__ == "__main__":
+    structured_log.setup()
     asyncio.run(scrape_tokens())
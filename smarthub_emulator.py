@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import secrets
+
+from fastapi import FastAPI, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse
+import uvicorn
+
+from gwt_decoder import ADDRESS_FIELDS
+from smarthub_rpc import TOKEN_FILE, DEFAULT_SERVICE_INTERFACE
+
+# Local stand-in for SmartHub: a Shop.html with the same form the browser path drives,
+# and a MemberService endpoint with configurable latency and error injection.
+# Run it with `python smarthub_emulator.py` and start api.py with SMARTHUB_BASE_URL=http://127.0.0.1:8006
+# The emulated page's request shape (one String search parameter) is this file's own invention,
+# not SmartHub's; the API doesn't rely on it, since it replays whatever body scraper.py recorded.
+
+app = FastAPI()
+
+# Tunable at startup from the command line or at runtime via POST /emulator/config
+config = {
+    "latency_ms": 0.0,      # mean MemberService latency
+    "jitter_ms": 0.0,       # +/- uniform jitter on top of the mean
+    "error_rate": 0.0,      # fraction of calls answered with HTTP 500
+    "reject_rate": 0.0,     # fraction answered with IncompatibleRemoteServiceException (stale tokens)
+    "boot_ms": 300.0,       # how long Shop.html takes to "load the GWT module" and render the form
+    "cities_ms": 50.0,      # delay before the city select is populated after a state change
+}
+
+DEFAULT_PERMUTATION = "CF11AE41C04179DCC6D71BA469049A23"
+DEFAULT_RPC_HASH = "B5942E1CFECF3F9B862E631514ED7F93"
+
+ADDRESS_TYPE = "coop.nisc.smarthub.consumer.shared.Address/1843217604"
+LIST_TYPE = "java.util.ArrayList/4159755760"
+INCOMPATIBLE_TYPE = "com.google.gwt.user.client.rpc.IncompatibleRemoteServiceException/3936916533"
+
+# street, city, state, zip, service type
+KNOWN_ADDRESSES = [
+    ("1900 West Oak Street", "Corvallis", "OR", "97330", "Fiber"),
+    ("100 Main Street", "Lebanon", "OR", "97355", "Fiber"),
+    ("250 SW Madison Avenue", "Corvallis", "OR", "97333", "Fiber"),
+    ("3435 NE Highway 20", "Corvallis", "OR", "97330", "Fixed Wireless"),
+    ("710 Main Street", "Philomath", "OR", "97370", "Fixed Wireless"),
+    ("100 Main Street", "Philomath", "OR", "97370", "Fixed Wireless"),
+    ("1250 Pacific Boulevard SE", "Albany", "OR", "97321", "Fiber"),
+]
+
+
+def load_expected_tokens():
+    path = os.environ.get("SMARTHUB_EMULATOR_TOKENS", TOKEN_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+expected_tokens = load_expected_tokens()
+permutation = expected_tokens.get("permutation") or DEFAULT_PERMUTATION
+rpc_hash = expected_tokens.get("rpc_hash") or DEFAULT_RPC_HASH
+
+# Sessions handed out by Shop.html, plus the one recorded in the token file
+sessions = {expected_tokens["jsessionid"]} if expected_tokens.get("jsessionid") else set()
+
+
+def split_gwt_payload(payload):
+    # Split on "|" while honouring the \\ and \! escapes used by GWT-RPC request strings
+    fields = []
+    current = []
+    i = 0
+    while i < len(payload):
+        ch = payload[i]
+        if ch == "\\" and i + 1 < len(payload):
+            nxt = payload[i + 1]
+            current.append("|" if nxt == "!" else nxt)
+            i += 2
+            continue
+        if ch == "|":
+            fields.append("".join(current))
+            current = []
+        else:
+            current.append(ch)
+        i += 1
+    if current:
+        fields.append("".join(current))
+    return fields
+
+
+def gwt_response(prefix, stream, strings):
+    # GWT writes the value stream in reverse, followed by the string table, flags and version
+    values = ",".join(str(v) for v in reversed(stream))
+    table = ",".join(json.dumps(s) for s in strings)
+    if values:
+        return f"{prefix}[{values},[{table}],0,7]"
+    return f"{prefix}[[{table}],0,7]"
+
+
+def encode_addresses(matches):
+    strings = []
+
+    def ref(s):
+        if s not in strings:
+            strings.append(s)
+        return strings.index(s) + 1
+
+    # Written in the decoder's assumed field layout, so this exercises the wire format and
+    # back-references but says nothing about whether that layout matches SmartHub's
+    stream = [ref(LIST_TYPE), len(matches)]
+    for street, city, state, zip_code, service in matches:
+        record = {"street": street, "city": city, "state": state, "zip": zip_code, "serviceable": True, "service": service}
+        stream.append(ref(ADDRESS_TYPE))
+        for name, kind in ADDRESS_FIELDS:
+            value = record.get(name, "" if kind == "string" else 0)
+            stream.append(ref(value) if kind == "string" else int(value))
+    return gwt_response("//OK", stream, strings)
+
+
+def incompatible(message):
+    return gwt_response("//EX", [1, 2], [INCOMPATIBLE_TYPE, message])
+
+
+def find_addresses(search_str):
+    needle = " ".join(search_str.lower().split())
+    if not needle:
+        return []
+    return [a for a in KNOWN_ADDRESSES if a[0].lower().startswith(needle) or needle.startswith(a[0].lower())]
+
+
+@app.post("/gwt/MemberService")
+async def member_service(request: Request):
+    body = (await request.body()).decode("utf-8")
+    fields = split_gwt_payload(body)
+
+    delay = config["latency_ms"] + random.uniform(-config["jitter_ms"], config["jitter_ms"])
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    if random.random() < config["error_rate"]:
+        return PlainTextResponse("Injected upstream failure", status_code=500)
+    if random.random() < config["reject_rate"]:
+        return PlainTextResponse(incompatible("This application is out of date, please click the refresh button on your browser."))
+
+    if len(fields) < 4 or fields[0] != "7":
+        return PlainTextResponse(incompatible("Malformed RPC request"), status_code=500)
+
+    table_size = int(fields[2])
+    strings = fields[3:3 + table_size]
+
+    if request.headers.get("x-gwt-permutation") != permutation:
+        return PlainTextResponse(incompatible("This application is out of date, please click the refresh button on your browser."))
+    if len(strings) < 2 or strings[1] != rpc_hash:
+        return PlainTextResponse(incompatible("Type name elision in RPC payloads is only supported if the RPC whitelist file is used."))
+    if request.cookies.get("JSESSIONID-consumer_1.0") not in sessions:
+        return PlainTextResponse("", status_code=401)
+
+    if "getAddressForMember" not in strings:
+        return PlainTextResponse(incompatible("Unknown method"), status_code=500)
+
+    search_str = strings[-1] if len(strings) > 5 else ""
+    return PlainTextResponse(encode_addresses(find_addresses(search_str)))
+
+
+@app.get("/emulator/cities")
+async def cities(state: str):
+    if config["cities_ms"] > 0:
+        await asyncio.sleep(config["cities_ms"] / 1000)
+    return sorted({a[1] for a in KNOWN_ADDRESSES if a[2] == state})
+
+
+@app.get("/emulator/config")
+async def get_config():
+    return config
+
+
+@app.post("/emulator/config")
+async def update_config(request: Request):
+    updates = await request.json()
+    for key, value in updates.items():
+        if key in config:
+            config[key] = float(value)
+    return config
+
+
+@app.get("/Shop.html", response_class=HTMLResponse)
+async def shop_page():
+    session = secrets.token_hex(16)
+    sessions.add(session)
+    page = SHOP_HTML
+    for name, value in (
+        ("__BOOT_MS__", str(int(config["boot_ms"]))),
+        ("__PERMUTATION__", permutation),
+        ("__RPC_HASH__", rpc_hash),
+        ("__SERVICE_INTERFACE__", expected_tokens.get("service_interface") or DEFAULT_SERVICE_INTERFACE),
+    ):
+        page = page.replace(name, value)
+    response = HTMLResponse(page)
+    response.set_cookie("JSESSIONID-consumer_1.0", session)
+    response.set_cookie("XSRF-TOKEN", secrets.token_urlsafe(16))
+    return response
+
+
+# Mirrors the parts of the real page the API touches: two selects (state, city), the
+# gwt-SuggestBox street input, a "Go!" button, and a verify list with its own "Go!" button
+# that appears when the street matches more than one address.
+SHOP_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Shop - SmartHub (emulator)</title>
+<link rel="stylesheet" href="/emulator/assets/shop.css">
+<style>.hidden { display: none; }</style>
+</head>
+<body>
+<img src="/emulator/assets/logo.png" alt="">
+<div id="app">Loading...</div>
+<script>
+const PERMUTATION = "__PERMUTATION__";
+const RPC_HASH = "__RPC_HASH__";
+const SERVICE_INTERFACE = "__SERVICE_INTERFACE__";
+const STATES = [["OR", "Oregon"], ["WA", "Washington"], ["CA", "California"], ["ID", "Idaho"]];
+
+function escapeGwt(s) {
+    return s.split("\\").join("\\\\").split("|").join("\\!");
+}
+
+function callMemberService(street) {
+    const strings = [location.origin + "/", RPC_HASH, SERVICE_INTERFACE, "getAddressForMember",
+                     "java.lang.String/2004016611", street];
+    const payload = "7|0|" + strings.length + "|" + strings.map(escapeGwt).join("|") + "|1|2|3|4|1|5|6|";
+    return fetch("/gwt/MemberService", {
+        method: "POST",
+        headers: {"Content-Type": "text/x-gwt-rpc; charset=utf-8", "X-GWT-Permutation": PERMUTATION},
+        body: payload,
+    }).then(r => r.text());
+}
+
+function matchCount(text) {
+    // Address count is the second value GWT serialized, i.e. second from the end of the value stream
+    const m = text.match(/^\/\/OK\[(.*),\[/);
+    if (!m) return 0;
+    const values = m[1].split(",");
+    return parseInt(values[values.length - 2] || "0", 10);
+}
+
+function render() {
+    const app = document.getElementById("app");
+    app.innerHTML = `
+        <label>State</label>
+        <select class="form-control"><option value="">-- Select State --</option>
+            ${STATES.map(s => `<option value="${s[0]}">${s[1]}</option>`).join("")}</select>
+        <label>City</label>
+        <select class="form-control"><option value="">-- Select City --</option></select>
+        <label>Street Address</label>
+        <input type="text" class="gwt-SuggestBox form-control">
+        <button type="button" class="btn btn-primary" id="go">Go!</button>
+        <div id="verify" class="hidden">
+            <p>Please confirm your address:</p>
+            <select class="form-control" id="matches"></select>
+            <button type="button" class="btn btn-primary" id="verify-go">Go!</button>
+        </div>
+        <div id="result"></div>`;
+
+    const [stateSel, citySel] = document.querySelectorAll("select");
+    stateSel.addEventListener("change", () => {
+        citySel.innerHTML = '<option value="">-- Select City --</option>';
+        if (!stateSel.value) return;
+        fetch("/emulator/cities?state=" + encodeURIComponent(stateSel.value))
+            .then(r => r.json())
+            .then(cities => cities.forEach(c => citySel.add(new Option(c, c))));
+    });
+
+    const input = document.querySelector("input.gwt-SuggestBox");
+    document.getElementById("go").addEventListener("click", () => {
+        document.getElementById("verify").classList.add("hidden");
+        callMemberService(input.value).then(text => {
+            const count = matchCount(text);
+            document.getElementById("result").textContent = count ? count + " address(es) found" : "No match";
+            if (count > 1) {
+                const strings = JSON.parse(text.slice(text.indexOf(",[") + 1, text.lastIndexOf("],") + 1));
+                const matches = document.getElementById("matches");
+                matches.innerHTML = "";
+                strings.filter(s => /^\d+ /.test(s)).forEach(s => matches.add(new Option(s, s)));
+                document.getElementById("verify").classList.remove("hidden");
+            }
+        });
+    });
+    document.getElementById("verify-go").addEventListener("click", () => {
+        callMemberService(document.getElementById("matches").value);
+    });
+}
+
+// Stand-in for the GWT module bootstrap
+setTimeout(render, __BOOT_MS__);
+</script>
+</body>
+</html>
+"""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local SmartHub emulator")
+    parser.add_argument("--port", type=int, default=8006)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--reject-rate", type=float, default=0.0)
+    parser.add_argument("--boot-ms", type=float, default=300.0)
+    args = parser.parse_args()
+    config.update(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        reject_rate=args.reject_rate,
+        boot_ms=args.boot_ms,
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port)
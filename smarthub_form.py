@@ -0,0 +1,262 @@
+import contextlib
+import logging
+import time
+
+from page_pool import SUGGEST_BOX_SELECTOR
+import tracing
+
+# Drives the Shop.html availability form on a settled page.
+# Every step waits on a real readiness signal from GWT instead of a fixed sleep,
+# and records how long it took so slow steps show up in the logs.
+
+log = logging.getLogger(__name__)
+
+GO_BUTTON_SELECTOR = "button.btn-primary:has-text('Go!')"
+
+SELECT_TIMEOUT = 5000
+SUBMIT_TIMEOUT = 10000
+VERIFY_TIMEOUT = 3000
+
+# Resolves truthy once the select at `index` has an option containing `label`, and selects it.
+# Used with wait_for_function so we move on the moment GWT has populated the options.
+SELECT_OPTION_JS = '''([index, label]) => {
+    const select = document.querySelectorAll('select')[index];
+    if (!select) return false;
+    const targetOpt = Array.from(select.options).find(o => o.text.includes(label));
+    if (!targetOpt) return false;
+    if (select.value !== targetOpt.value) {
+        select.value = targetOpt.value;
+        select.dispatchEvent(new Event('change', { bubbles: true }));
+    }
+    return true;
+}'''
+
+# Direct assignment for a value learned earlier. Keeps polling until the select has been
+# (re)filled, then reports "missing" rather than waiting out the timeout if the value is gone.
+SELECT_VALUE_JS = '''([index, value]) => {
+    const select = document.querySelectorAll('select')[index];
+    if (!select || select.options.length <= 1) return false;
+    if (!Array.from(select.options).some(o => o.value === value)) return "missing";
+    if (select.value !== value) {
+        select.value = value;
+        select.dispatchEvent(new Event('change', { bubbles: true }));
+    }
+    return true;
+}'''
+
+CAPTURE_OPTIONS_JS = '''(index) => {
+    const select = document.querySelectorAll('select')[index];
+    return select ? Array.from(select.options).filter(o => o.value).map(o => [o.text.trim(), o.value]) : [];
+}'''
+
+CLICK_GO_JS = '''() => {
+    const btns = Array.from(document.querySelectorAll('button'));
+    const goBtn = btns.find(b => b.textContent.includes('Go!'));
+    if(goBtn) goBtn.click();
+}'''
+
+# GWT renders the RPC callback synchronously, so one frame after the response the DOM is current
+NEXT_FRAME_JS = '''() => new Promise(resolve => requestAnimationFrame(() => resolve(true)))'''
+
+
+class SubmitFailed(Exception):
+    pass
+
+
+class OptionMaps:
+    # Label -> value maps for the state select and, per state, the city select. Learned from the
+    # page the first time a label is used, then applied by value; a value the portal no longer
+    # offers drops the map so it is captured again.
+    def __init__(self):
+        self.states = {}
+        self.cities = {}
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    @staticmethod
+    def _match(options, label):
+        label = label.strip().lower()
+        if label in options:
+            return options[label]
+        # Same rule as the text search: the option text only has to contain the label
+        for text, value in options.items():
+            if label in text:
+                return value
+        return None
+
+    def value_for(self, index, label, state_label):
+        options = self.states if index == 0 else self.cities.get(state_label.lower(), {})
+        value = self._match(options, label)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def learn(self, index, state_label, pairs):
+        options = {text.lower(): value for text, value in pairs}
+        if index == 0:
+            self.states = options
+        else:
+            self.cities[state_label.lower()] = options
+
+    def forget(self, index, state_label):
+        self.refreshes += 1
+        if index == 0:
+            # New state values probably mean new city values as well
+            self.states = {}
+            self.cities = {}
+        else:
+            self.cities.pop(state_label.lower(), None)
+
+    def stats(self):
+        return {
+            "states": len(self.states),
+            "cities": sum(len(c) for c in self.cities.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+        }
+
+
+class StepTimings:
+    def __init__(self, on_step=None):
+        self.steps = {}
+        # Optional callback told the name of each step as it starts, used for live job progress
+        self.on_step = on_step
+
+    def started(self, name):
+        if self.on_step:
+            self.on_step(name)
+
+    @contextlib.contextmanager
+    def step(self, name):
+        self.started(name)
+        start = time.perf_counter()
+        try:
+            with tracing.span(name):
+                yield
+        finally:
+            self._accumulate(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        # For a step timed by the caller rather than wrapped in step()
+        tracing.record(name, seconds)
+        self._accumulate(name, seconds)
+
+    def _accumulate(self, name, seconds):
+        self.steps[name] = self.steps.get(name, 0.0) + seconds
+
+    def summary(self):
+        return " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.steps.items())
+
+
+def is_member_service_response(response):
+    return response.request.method == "POST" and "MemberService" in response.url
+
+
+async def select_option(page, index, label):
+    try:
+        await page.wait_for_function(SELECT_OPTION_JS, arg=[index, label], timeout=SELECT_TIMEOUT, polling="raf")
+        return True
+    except Exception:
+        log.warning("Option '%s' never appeared in select %s, continuing without it", label, index)
+        return False
+
+
+async def choose_option(page, index, label, state_label, option_maps=None):
+    # Assign a remembered value directly; fall back to the text search (and learn the map) otherwise
+    if option_maps is None:
+        return await select_option(page, index, label)
+    value = option_maps.value_for(index, label, state_label)
+    if value is not None:
+        try:
+            handle = await page.wait_for_function(SELECT_VALUE_JS, arg=[index, value], timeout=SELECT_TIMEOUT, polling="raf")
+            if await handle.json_value() is True:
+                return True
+        except Exception:
+            pass
+        log.info("Cached value for '%s' no longer offered in select %s, refreshing options", label, index)
+        option_maps.forget(index, state_label)
+    found = await select_option(page, index, label)
+    if found:
+        try:
+            option_maps.learn(index, state_label, await page.evaluate(CAPTURE_OPTIONS_JS, index))
+        except Exception as e:
+            log.warning("Could not capture options of select %s: %s", index, e)
+    return found
+
+
+async def submit_form(page, timings):
+    # Click Go and wait for the MemberService response simultaneously
+    try:
+        go_button = page.locator(GO_BUTTON_SELECTOR).first
+        async with page.expect_response(is_member_service_response, timeout=SUBMIT_TIMEOUT) as response_info:
+            with timings.step("submit"):
+                await go_button.click(force=True, timeout=5000)
+            log.debug("Clicked Go Button via Playwright", extra={"sample": True})
+            clicked_at = time.perf_counter()
+            timings.started("response")
+        # Leaving the block waits for the MemberService response
+        timings.add("response", time.perf_counter() - clicked_at)
+        return await response_info.value
+    except Exception as e:
+        log.warning("Failed to click Go Button or timed out waiting for response: %s", e)
+
+    try:
+        async with page.expect_response(is_member_service_response, timeout=SUBMIT_TIMEOUT) as response_info:
+            with timings.step("submit"):
+                await page.evaluate(CLICK_GO_JS)
+            log.info("Clicked Go Button via JS", extra={"sample": True})
+            clicked_at = time.perf_counter()
+            timings.started("response")
+        # Leaving the block waits for the MemberService response
+        timings.add("response", time.perf_counter() - clicked_at)
+        return await response_info.value
+    except Exception as e:
+        log.warning("JS Click also failed: %s", e)
+        raise SubmitFailed(str(e))
+
+
+async def fill_shop_form(page, street, city, state_label, timings, option_maps=None):
+    # 1. State: wait for the options to be populated, then select
+    with timings.step("state"):
+        await choose_option(page, 0, state_label, state_label, option_maps)
+
+    # 2. City: GWT refills this select after the state change, so waiting on the option is the readiness signal
+    if city:
+        with timings.step("city"):
+            await choose_option(page, 1, city, state_label, option_maps)
+
+    # 3. Street
+    with timings.step("fill"):
+        input_el = page.locator(SUGGEST_BOX_SELECTOR).first
+        await input_el.wait_for(state="attached", timeout=SELECT_TIMEOUT)
+        await input_el.fill(street, force=True)
+        await input_el.press("Enter")
+        await input_el.press("Tab")
+
+    # 4. Submit, then wait for the MemberService reply
+    response = await submit_form(page, timings)
+    with timings.step("response"):
+        captured_response = await response.text()
+    log.debug("Captured Response length: %s", len(captured_response), extra={"sample": True})
+
+    # 5. Address matching verify list (a second Go button becomes visible for fuzzy matches)
+    with timings.step("verify"):
+        try:
+            await page.evaluate(NEXT_FRAME_JS)
+            verify_go_buttons = page.locator(GO_BUTTON_SELECTOR)
+            count = await verify_go_buttons.count()
+            # Index 0 is the main Go button we already submitted with
+            for i in range(1, count):
+                btn = verify_go_buttons.nth(i)
+                if await btn.is_visible() and await btn.is_enabled():
+                    async with page.expect_response(is_member_service_response, timeout=VERIFY_TIMEOUT):
+                        await btn.click(force=True, timeout=VERIFY_TIMEOUT)
+                    log.info("Clicked secondary Go button for verify list", extra={"sample": True})
+        except Exception:
+            pass
+
+    return captured_response
@@ -0,0 +1,159 @@
+import json
+import logging
+import os
+
+import httpx
+
+from gwt_decoder import DecodeError, parse_exception
+
+# Direct GWT-RPC client for the SmartHub MemberService.
+# Instead of driving Shop.html in Chromium we replay the getAddressForMember call
+# ourselves using the session tokens that scraper.py captures into smarthub_tokens.json.
+# The request body is not built from an assumed method signature: scraper.py records the
+# body the real page sent for a probe street, and the client substitutes the street into
+# that template. A captured call that doesn't carry the probe (the page sent no search
+# parameter) leaves the fast path disabled and every lookup goes through the browser.
+
+log = logging.getLogger(__name__)
+
+SMARTHUB_BASE_URL = os.environ.get("SMARTHUB_BASE_URL", "https://peak.smarthub.coop").rstrip("/")
+TOKEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "smarthub_tokens.json")
+
+REQUIRED_TOKENS = ("jsessionid", "xsrf_token", "permutation", "rpc_hash")
+
+# Fallback for token files written before scraper.py started recording the service interface
+DEFAULT_SERVICE_INTERFACE = "coop.nisc.smarthub.consumer.client.rpc.MemberService"
+
+# Street the scraper types into Shop.html, and what replaces it in the recorded request body
+SCRAPE_PROBE_STREET = "100 Main St"
+SEARCH_PLACEHOLDER = "%SEARCH%"
+
+
+class TokensRejected(Exception):
+    # Raised when SmartHub refuses our stored session (expired cookie, new permutation, stale policy hash)
+    def __init__(self, message, tokens=None):
+        super().__init__(message)
+        self.tokens = tokens
+
+
+def escape_gwt_string(value):
+    # GWT-RPC request strings use "|" as the field separator, so backslashes and pipes are escaped
+    return value.replace("\\", "\\\\").replace("|", "\\!")
+
+
+def make_payload_template(post_data, probe=SCRAPE_PROBE_STREET):
+    # The captured getAddressForMember body with the probe street swapped for the placeholder,
+    # or None when the probe isn't one of its string fields
+    field = "|" + escape_gwt_string(probe) + "|"
+    if not post_data or field not in post_data or post_data.count(field) > 1:
+        return None
+    return post_data.replace(field, "|" + SEARCH_PLACEHOLDER + "|")
+
+
+def has_template(tokens):
+    return SEARCH_PLACEHOLDER in (tokens.get("payload_template") or "")
+
+
+class SmartHubRpcClient:
+    def __init__(self, base_url=SMARTHUB_BASE_URL, token_file=TOKEN_FILE, timeout=10.0, max_connections=20):
+        self.base_url = base_url.rstrip("/")
+        self.token_file = token_file
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.tokens = None
+        self._client = None
+
+    @property
+    def available(self):
+        return self._client is not None and self.tokens is not None and has_template(self.tokens)
+
+    def load_tokens(self):
+        try:
+            with open(self.token_file, "r", encoding="utf-8") as f:
+                tokens = json.load(f)
+        except (OSError, ValueError) as e:
+            # Keep whatever tokens we already have; a bad file never wipes a working session
+            log.warning("Could not read SmartHub tokens: %s", e)
+            return False
+        return self.set_tokens(tokens)
+
+    def set_tokens(self, tokens):
+        if not all(tokens.get(k) for k in REQUIRED_TOKENS):
+            log.warning("SmartHub tokens are incomplete, ignoring them.")
+            return False
+
+        if not has_template(tokens):
+            log.warning("No getAddressForMember request template in the SmartHub tokens; "
+                        "lookups use the browser until scraper.py captures one.")
+        # Swapped as a whole so a call in flight never mixes old and new values
+        self.tokens = tokens
+        return True
+
+    def invalidate(self, rejected=None):
+        # Stop using the current tokens until they are reloaded. When a specific token set
+        # was rejected, only drop it if a refresh hasn't already replaced it.
+        if rejected is None or self.tokens is rejected:
+            self.tokens = None
+
+    async def start(self):
+        self.load_tokens()
+        # One pooled keep-alive client shared by every lookup
+        self._client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+        )
+
+    async def close(self):
+        if self._client:
+            await self._client.aclose()
+            self._client = None
+
+    def rpc_url(self, tokens):
+        return tokens.get("rpc_url") or f"{self.base_url}/gwt/MemberService"
+
+    def build_payload(self, tokens, search_str):
+        # Exactly the body the page sent, with our street in place of the probe
+        return tokens["payload_template"].replace(SEARCH_PLACEHOLDER, escape_gwt_string(search_str), 1)
+
+    def build_headers(self, tokens):
+        return {
+            "Content-Type": "text/x-gwt-rpc; charset=utf-8",
+            "X-GWT-Permutation": tokens["permutation"],
+            "X-GWT-Module-Base": tokens.get("module_base") or f"{self.base_url}/",
+            "X-XSRF-TOKEN": tokens["xsrf_token"],
+            "Cookie": f"JSESSIONID-consumer_1.0={tokens['jsessionid']}; XSRF-TOKEN={tokens['xsrf_token']}",
+        }
+
+    async def get_address_for_member(self, search_str):
+        tokens = self.tokens
+        if tokens is None or self._client is None:
+            raise TokensRejected("No SmartHub tokens loaded")
+
+        response = await self._client.post(
+            self.rpc_url(tokens),
+            content=self.build_payload(tokens, search_str).encode("utf-8"),
+            headers=self.build_headers(tokens),
+        )
+
+        if response.status_code in (401, 403):
+            raise TokensRejected(f"HTTP {response.status_code}", tokens)
+
+        body = response.text
+        if body.startswith("//EX"):
+            # Session, permutation and serialization policy errors all mean our tokens are stale.
+            # Anything else is a genuine answer from the service and is returned as-is.
+            try:
+                error = parse_exception(body)
+                lowered = f"{error.type_name} {error.message}".lower()
+            except DecodeError:
+                lowered = body.lower()
+            if "incompatibleremoteservice" in lowered or "xsrf" in lowered or "session" in lowered:
+                raise TokensRejected(body[:200], tokens)
+        elif not response.is_success and not body.startswith("//OK"):
+            # 404, 429, a proxy's HTML error page: a transport failure, not the service's answer
+            response.raise_for_status()
+
+        return body
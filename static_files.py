@@ -0,0 +1,401 @@
+import asyncio
+import email.utils
+import fnmatch
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import stat as stat_module
+from collections import OrderedDict
+
+from starlette.responses import FileResponse, PlainTextResponse, Response
+
+from fingerprint_assets import load_manifest
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Static file layer for the site. Small files are held in memory together with their
+# gzip/brotli variants (taken from a sibling .gz/.br built ahead of time, otherwise
+# compressed once on first load, in a thread and at a moderate level; precompress()
+# spends the maximum levels ahead of time), so a page view costs a stat and a dict lookup.
+# Responses carry strong ETags and Last-Modified, answer conditional requests with 304,
+# and support single byte ranges on the identity representation.
+
+STATIC_CACHE_MAX_BYTES = int(os.environ.get("STATIC_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+STATIC_CACHE_MAX_FILE_BYTES = int(os.environ.get("STATIC_CACHE_MAX_FILE_BYTES", str(2 * 1024 * 1024)))
+STATIC_MAX_AGE = int(os.environ.get("STATIC_MAX_AGE", "3600"))
+
+# Fingerprinted names from asset-manifest.json never change content
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Below this a compressed body plus its headers rarely beats the original
+MIN_COMPRESS_BYTES = 512
+
+COMPRESSIBLE_TYPES = {
+    "application/javascript", "text/javascript", "application/json", "application/xml",
+    "image/svg+xml", "application/manifest+json", "application/wasm",
+}
+
+# Encodings in order of preference, with the sibling-file suffix a build step may have written
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# Runtime state that may end up beside the site (SQLite files and their WAL/SHM, trace and
+# request logs, temp files) is never served, whatever directory it was configured into
+DENIED_NAMES = ("*.db", "*.db-*", "*.sqlite*", "*.jsonl", "*.jsonl.*", "*.tmp")
+RUNTIME_DIRS = ("var", "asset_cache", "__pycache__")
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def is_compressible(content_type):
+    return content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES
+
+
+def compress(encoding, body, best=False):
+    # best=True for the build step; on demand a middling level gets most of the ratio far faster
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=9 if best else 6, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(body, quality=11 if best else 5)
+    return None
+
+
+def is_denied_name(name):
+    return any(fnmatch.fnmatch(name, pattern) for pattern in DENIED_NAMES)
+
+
+def accepted_encodings(header):
+    # Parse "gzip, br;q=0.8, *;q=0" into {coding: q}
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def negotiate(header, available):
+    accepted = accepted_encodings(header or "")
+    best, best_q = None, 0.0
+    for encoding, _ in ENCODINGS:
+        if encoding not in available:
+            continue
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def etag_matches(header, etag):
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison, so a W/ prefix is ignored
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def parse_range(header, size):
+    # Single ranges only; anything else is ignored and the full body is sent, as RFC 9110 allows
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            return ()
+        return (max(0, size - length), size - 1)
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return ()
+    return (start, end)
+
+
+class StaticEntry:
+    __slots__ = ("path", "mtime_ns", "size", "content_type", "etag", "last_modified", "body", "variants",
+                 "immutable")
+
+    def __init__(self, path, stat, content_type, body, immutable=False):
+        self.path = path
+        self.immutable = immutable
+        self.mtime_ns = stat.st_mtime_ns
+        self.size = stat.st_size
+        self.content_type = content_type
+        self.last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        self.body = body
+        # encoding -> (body, etag)
+        self.variants = {}
+        if body is not None:
+            self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        else:
+            # Too large to hold in memory: derive the validator from size and mtime instead
+            self.etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+    @property
+    def memory(self):
+        if self.body is None:
+            return 0
+        return len(self.body) + sum(len(body) for body, _ in self.variants.values())
+
+
+class StaticFiles:
+    def __init__(self, directory, html=True, max_bytes=STATIC_CACHE_MAX_BYTES,
+                 max_file_bytes=STATIC_CACHE_MAX_FILE_BYTES, max_age=STATIC_MAX_AGE, exclude=(), manifest=None):
+        self.directory = os.path.realpath(directory)
+        self.html = html
+        self.max_bytes = max_bytes
+        self.max_file_bytes = max_file_bytes
+        self.max_age = max_age
+        self.exclude = {os.path.realpath(p) for p in exclude if p}
+        self.manifest = manifest
+        self._entries = OrderedDict()
+        self._memory = 0
+        self.hits = 0
+        self.loads = 0
+        self.not_modified = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+        response = await self.respond(scope)
+        await response(scope, receive, send)
+
+    async def respond(self, scope):
+        method = scope["method"]
+        if method not in ("GET", "HEAD"):
+            return PlainTextResponse("Method Not Allowed", status_code=405, headers={"Allow": "GET, HEAD"})
+
+        resolved = self.resolve(scope.get("path", "/"))
+        status = 200
+        if resolved is None and self.html:
+            resolved = self.resolve("/404.html")
+            status = 404
+        if resolved is None:
+            return PlainTextResponse("Not Found", status_code=404)
+        path, stat = resolved
+
+        entry = await self.entry(path, stat)
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        return self.build_response(entry, headers, method == "HEAD", status)
+
+    def resolve(self, url_path):
+        relative = url_path.lstrip("/")
+        parts = [p for p in relative.split("/") if p]
+        # No dotfiles (.git, .server_pid), runtime state, or escaping the root
+        if any(p.startswith(".") or p in RUNTIME_DIRS for p in parts):
+            return None
+        full = os.path.realpath(os.path.join(self.directory, *parts))
+        if full != self.directory and not full.startswith(self.directory + os.sep):
+            return None
+        candidates = [full]
+        if self.html:
+            candidates = [full, os.path.join(full, "index.html"), full + ".html"]
+        for candidate in candidates:
+            if self.is_excluded(candidate):
+                return None
+            try:
+                stat = os.stat(candidate)
+            except OSError:
+                continue
+            if stat_module.S_ISREG(stat.st_mode):
+                return candidate, stat
+        return None
+
+    def is_excluded(self, path):
+        # exclude holds files and directories; a directory covers everything below it and a file
+        # its siblings (availability.db-wal, traces.jsonl.1)
+        if is_denied_name(os.path.basename(path)):
+            return True
+        return any(path == p or path.startswith((p + os.sep, p + "-", p + ".")) for p in self.exclude)
+
+    async def entry(self, path, stat):
+        entry = self._entries.get(path)
+        if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return entry
+        if entry is not None:
+            self._forget(path)
+        self.loads += 1
+        # Reading and compressing happen off the event loop; only the cache bookkeeping runs on it
+        entry = await asyncio.to_thread(self._build, path, stat)
+        if entry.body is not None:
+            self._store(entry)
+        return entry
+
+    def _build(self, path, stat):
+        content_type, _ = mimetypes.guess_type(path)
+        content_type = content_type or "application/octet-stream"
+        immutable = self.is_fingerprinted(path)
+        if stat.st_size > self.max_file_bytes:
+            return StaticEntry(path, stat, content_type, None, immutable)
+
+        with open(path, "rb") as f:
+            body = f.read()
+        entry = StaticEntry(path, stat, content_type, body, immutable)
+        if is_compressible(content_type) and len(body) >= MIN_COMPRESS_BYTES:
+            for encoding, suffix in ENCODINGS:
+                compressed = self._prebuilt(path + suffix, stat) or compress(encoding, body)
+                if compressed is not None and len(compressed) < len(body):
+                    tag = "-br" if encoding == "br" else "-gz"
+                    entry.variants[encoding] = (compressed, entry.etag[:-1] + tag + '"')
+        return entry
+
+    def _store(self, entry):
+        path = entry.path
+        if path in self._entries:
+            # Another request loaded it while this one was in the thread
+            self._forget(path)
+        self._entries[path] = entry
+        self._memory += entry.memory
+        while self._memory > self.max_bytes and len(self._entries) > 1:
+            self._forget(next(iter(self._entries)))
+        return entry
+
+    def is_fingerprinted(self, path):
+        # Read on every load rather than once, so a rebuild is picked up the first time its new names are requested
+        if not self.manifest:
+            return False
+        hashed = {os.path.join(self.directory, name) for name in load_manifest(self.manifest).values()}
+        return path in hashed
+
+    def _prebuilt(self, path, source_stat):
+        # A .gz/.br written by a build step is used only while it is at least as new as its source
+        try:
+            if os.stat(path).st_mtime_ns < source_stat.st_mtime_ns:
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _forget(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._memory -= entry.memory
+
+    def cache_control(self, entry):
+        # Pages must revalidate so content edits show up; assets can be reused for a while
+        if entry.immutable:
+            return IMMUTABLE_CACHE_CONTROL
+        if entry.content_type == "text/html":
+            return "no-cache"
+        return f"public, max-age={self.max_age}"
+
+    def build_response(self, entry, headers, head, status=200):
+        media_type = entry.content_type
+        if media_type.startswith("text/") or media_type in ("application/javascript", "application/json"):
+            media_type += "; charset=utf-8"
+        base = {
+            "Last-Modified": entry.last_modified,
+            "Cache-Control": self.cache_control(entry),
+            "Accept-Ranges": "bytes",
+        }
+        if entry.variants:
+            base["Vary"] = "Accept-Encoding"
+
+        encoding = negotiate(headers.get("accept-encoding"), entry.variants) if entry.variants else None
+        body, etag = entry.variants[encoding] if encoding else (entry.body, entry.etag)
+        base["ETag"] = etag
+
+        if status == 200 and self.is_not_modified(headers, entry, etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=base)
+
+        if entry.body is None:
+            # Large file streamed from disk; Starlette handles ranges and HEAD for these
+            return FileResponse(entry.path, status_code=status, headers=base, media_type=media_type,
+                                method="HEAD" if head else "GET", stat_result=os.stat(entry.path))
+
+        if encoding:
+            base["Content-Encoding"] = encoding
+        elif status == 200 and "range" in headers and self.range_applies(headers, entry):
+            byte_range = parse_range(headers["range"], entry.size)
+            if byte_range == ():
+                base["Content-Range"] = f"bytes */{entry.size}"
+                return Response(status_code=416, headers=base)
+            if byte_range is not None:
+                start, end = byte_range
+                base["Content-Range"] = f"bytes {start}-{end}/{entry.size}"
+                status, body = 206, body[start:end + 1]
+
+        if head:
+            base["Content-Length"] = str(len(body))
+            return Response(status_code=status, headers=base, media_type=media_type)
+        return Response(body, status_code=status, headers=base, media_type=media_type)
+
+    def is_not_modified(self, headers, entry, etag):
+        if_none_match = headers.get("if-none-match")
+        if if_none_match is not None:
+            return etag_matches(if_none_match, etag)
+        if_modified_since = headers.get("if-modified-since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(entry.mtime_ns // 1_000_000_000) <= since
+        return False
+
+    def range_applies(self, headers, entry):
+        if_range = headers.get("if-range")
+        if if_range is None:
+            return True
+        # If-Range carries either a strong ETag or a date; a mismatch means "send it all"
+        if if_range.startswith('"'):
+            return if_range == entry.etag
+        return if_range == entry.last_modified
+
+    def stats(self):
+        return {
+            "files": len(self._entries),
+            "memory_bytes": self._memory,
+            "hits": self.hits,
+            "loads": self.loads,
+            "not_modified": self.not_modified,
+            "brotli": brotli is not None,
+        }
+
+
+def precompress(directory):
+    # Write .gz/.br siblings ahead of time so the server never compresses on the request path
+    written = 0
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith(".") and d not in RUNTIME_DIRS]
+        for name in files:
+            path = os.path.join(root, name)
+            content_type, _ = mimetypes.guess_type(path)
+            if name.startswith(".") or is_denied_name(name) or not content_type or not is_compressible(content_type):
+                continue
+            with open(path, "rb") as f:
+                body = f.read()
+            if len(body) < MIN_COMPRESS_BYTES:
+                continue
+            for encoding, suffix in ENCODINGS:
+                compressed = compress(encoding, body, best=True)
+                if compressed is not None and len(compressed) < len(body):
+                    with open(path + suffix, "wb") as f:
+                        f.write(compressed)
+                    written += 1
+    return written
+
+
+if __name__ == "__main__":
+    import sys
+    target = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+    print(f"Wrote {precompress(target)} precompressed files under {target}.")
@@ -0,0 +1,135 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+import tracing
+
+# JSON-lines logging that never blocks the event loop. Loggers only put the LogRecord on a
+# bounded queue (dropping it, and counting the drop, when the queue is full); a listener
+# thread does the formatting and the writing, so a slow stdout or log collector stalls that
+# thread rather than request handling. Each line carries the trace id of the request that
+# logged it, the same id api.py returns as X-Request-Id and writes to the trace file.
+# Per-lookup chatter is logged with extra={"sample": True} and only LOG_SAMPLE_RATE of it
+# is kept; anything at WARNING or above is always kept.
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.1"))
+# "json" for log collectors, "text" for reading in a terminal
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+
+# Attributes every LogRecord has (plus uvicorn's ANSI copy of the message); anything else came from extra={...}
+RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample", "trace_id", "color_message"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "trace_id", None):
+            entry["trace_id"] = record.trace_id
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, separators=(",", ":"))
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s - %(levelname)s - %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = {k: v for k, v in vars(record).items() if k not in RESERVED_ATTRS}
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if getattr(record, "trace_id", None):
+            line += f" trace_id={record.trace_id}"
+        return line
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    # Runs on the logging thread (usually the event loop): sample, tag, enqueue, nothing else
+    def __init__(self, log_queue, sample_rate=LOG_SAMPLE_RATE):
+        super().__init__(log_queue)
+        self.sample_rate = sample_rate
+        self.enqueued = 0
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def emit(self, record):
+        if getattr(record, "sample", False) and record.levelno < logging.WARNING and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        try:
+            self.enqueue(self.prepare(record))
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        # Formatting is left to the listener thread; only the context-bound trace id is read here
+        record.trace_id = tracing.current_trace_id()
+        return record
+
+    def enqueue(self, record):
+        self.queue.put_nowait(record)
+
+
+handler = None
+listener = None
+
+
+def setup(level=LOG_LEVEL, queue_size=LOG_QUEUE_SIZE, sample_rate=LOG_SAMPLE_RATE, fmt=LOG_FORMAT, stream=None):
+    # Routes the root logger through the queue; safe to call more than once
+    global handler, listener
+    if handler is not None:
+        return handler
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(TextFormatter() if fmt == "text" else JsonFormatter())
+    handler = QueueLogHandler(queue.Queue(queue_size), sample_rate)
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+    # httpx logs every request at INFO, one per rpc lookup
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    listener = logging.handlers.QueueListener(handler.queue, output)
+    listener.start()
+    atexit.register(shutdown)
+    return handler
+
+
+def shutdown():
+    # Writes out whatever is still queued
+    global handler, listener
+    if listener is not None:
+        listener.stop()
+        logging.getLogger().removeHandler(handler)
+    handler = listener = None
+
+
+def stats():
+    if handler is None:
+        return None
+    return {
+        "queued": handler.queue.qsize(),
+        "queue_size": handler.queue.maxsize,
+        "enqueued": handler.enqueued,
+        "dropped": handler.dropped,
+        "sampled_out": handler.sampled_out,
+        "sample_rate": handler.sample_rate,
+    }
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from gwt_decoder import ADDRESS_FIELDS, ADDRESS_TYPE_PREFIX, DecodeError, GwtException, decode_addresses
+
+# Run with `python -m pytest -q test_gwt_decoder.py`
+
+ADDRESS_TYPE = ADDRESS_TYPE_PREFIX + "1843217604"
+LIST_TYPE = "java.util.ArrayList/4159755760"
+
+RECORDS = [
+    {"street": "1900 West Oak Street", "city": "Corvallis", "state": "OR", "zip": "97330", "serviceable": True, "service": "Fiber"},
+    {"street": "100 Main Street", "city": "Lebanon", "state": "OR", "zip": "97355", "serviceable": False, "service": "Fiber"},
+]
+
+
+def encode(records, fields=ADDRESS_FIELDS, prefix="//OK"):
+    # Same shape GWT's server writer produces: values reversed, then the string table, flags, version
+    strings = []
+
+    def ref(s):
+        if s not in strings:
+            strings.append(s)
+        return strings.index(s) + 1
+
+    stream = [ref(LIST_TYPE), len(records)]
+    for record in records:
+        stream.append(ref(ADDRESS_TYPE))
+        for name, kind in fields:
+            value = record.get(name, "" if kind == "string" else 0)
+            stream.append(ref(value) if kind == "string" else int(value))
+    values = ",".join(str(v) for v in reversed(stream))
+    return f"{prefix}[{values},{json.dumps(strings)},0,7]"
+
+
+def test_round_trip():
+    assert decode_addresses(encode(RECORDS)) == RECORDS
+
+
+def test_empty_list():
+    assert decode_addresses(encode([])) == []
+
+
+def test_extra_field_is_a_decode_error():
+    # One more field on the wire than the layout expects, e.g. a unit line after the street
+    fields = tuple(sorted(ADDRESS_FIELDS + (("unit", "string"),)))
+    records = [dict(r, unit="Apt 2") for r in RECORDS]
+    with pytest.raises(DecodeError):
+        decode_addresses(encode(records, fields))
+
+
+def test_single_record_with_extra_field_is_a_decode_error():
+    fields = ADDRESS_FIELDS + (("unit", "string"),)
+    with pytest.raises(DecodeError):
+        decode_addresses(encode([dict(RECORDS[0], unit="Apt 2")], fields))
+
+
+def test_missing_field_is_a_decode_error():
+    with pytest.raises(DecodeError):
+        decode_addresses(encode(RECORDS, ADDRESS_FIELDS[1:]))
+
+
+def test_exception_response():
+    body = '//EX[2,1,["com.google.gwt.user.client.rpc.IncompatibleRemoteServiceException/3936916533","stale"],0,7]'
+    with pytest.raises(GwtException) as e:
+        decode_addresses(body)
+    assert e.value.message == "stale"
+
+
+def test_not_gwt_rpc():
+    with pytest.raises(DecodeError):
+        decode_addresses("<html>Service Unavailable</html>")
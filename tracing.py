@@ -0,0 +1,191 @@
+import asyncio
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import random
+import secrets
+import time
+
+from runtime_paths import VAR_DIR, ensure_parent
+
+# Lightweight spans for attributing lookup latency. A span is opened with `span(name)`,
+# nests under whatever span is current in the task, and on exit is
+#   - added to the request's Trace, which api.py turns into a Server-Timing header, and
+#   - queued for the trace file as a Chrome trace event ("ph": "X"), one JSON object per line.
+# `python tracing.py traces.jsonl > trace.json` wraps the file for chrome://tracing or Perfetto.
+
+TRACE_FILE = os.environ.get("TRACE_FILE", os.path.join(VAR_DIR, "traces.jsonl"))
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "1.0"))
+TRACE_MAX_BYTES = int(os.environ.get("TRACE_MAX_BYTES", str(50 * 1024 * 1024)))
+TRACE_FLUSH_INTERVAL = 1.0
+
+log = logging.getLogger(__name__)
+
+# Chrome trace timestamps are microseconds; anchor perf_counter to the wall clock once
+_EPOCH_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "duration_ns", "attrs")
+
+    def __init__(self, name, parent, trace, attrs, start_ns=None):
+        self.name = name
+        self.trace_id = trace.id if trace else (parent.trace_id if parent else secrets.token_hex(8))
+        self.span_id = secrets.token_hex(4)
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = start_ns if start_ns is not None else time.perf_counter_ns()
+        self.duration_ns = None
+        self.attrs = attrs
+
+    @property
+    def duration_ms(self):
+        return (self.duration_ns or 0) / 1e6
+
+    def event(self):
+        return {
+            "name": self.name,
+            "cat": "lookup",
+            "ph": "X",
+            "ts": (self.start_ns + _EPOCH_OFFSET_NS) // 1000,
+            "dur": (self.duration_ns or 0) // 1000,
+            "pid": os.getpid(),
+            # One lane per trace so concurrent requests don't overlap in the viewer
+            "tid": int(self.trace_id[:8], 16),
+            "args": {"trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id, **self.attrs},
+        }
+
+
+class Trace:
+    # Spans finished while handling one request, in completion order
+    def __init__(self, sampled=True):
+        self.id = secrets.token_hex(8)
+        self.sampled = sampled
+        self.spans = []
+
+    def server_timing(self, exclude=()):
+        # Server-Timing: name;dur=ms, summed per span name in first-seen order
+        totals = {}
+        for s in self.spans:
+            if s.name not in exclude:
+                totals[s.name] = totals.get(s.name, 0.0) + s.duration_ms
+        return ", ".join(f"{name};dur={ms:.1f}" for name, ms in totals.items())
+
+
+class TraceExporter:
+    def __init__(self, path=TRACE_FILE, max_bytes=TRACE_MAX_BYTES, flush_interval=TRACE_FLUSH_INTERVAL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._buffer = []
+        self._task = None
+        self.exported = 0
+        self.dropped = 0
+
+    def start(self):
+        if self.path and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def emit(self, span):
+        if not self._task:
+            return
+        # Bounded so a stuck disk can't grow memory without limit
+        if len(self._buffer) >= 10000:
+            self.dropped += 1
+            return
+        self._buffer.append(span.event())
+
+    def _write(self, events):
+        ensure_parent(self.path)
+        try:
+            if os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+        except OSError:
+            pass
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(e, separators=(",", ":")) + "\n" for e in events))
+
+    async def flush(self):
+        if not self._buffer or not self.path:
+            return
+        events, self._buffer = self._buffer, []
+        try:
+            await asyncio.to_thread(self._write, events)
+            self.exported += len(events)
+        except OSError as e:
+            self.dropped += len(events)
+            log.warning("Failed to write trace events: %s", e)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+exporter = TraceExporter()
+
+
+def _finish(s):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.spans.append(s)
+    if trace is None or trace.sampled:
+        exporter.emit(s)
+
+
+@contextlib.contextmanager
+def span(name, **attrs):
+    s = Span(name, _current_span.get(), _current_trace.get(), attrs)
+    token = _current_span.set(s)
+    try:
+        yield s
+    finally:
+        s.duration_ns = time.perf_counter_ns() - s.start_ns
+        _current_span.reset(token)
+        _finish(s)
+
+
+def record(name, seconds, **attrs):
+    # A span measured after the fact, ending now (e.g. waiting on a response Playwright awaited for us)
+    duration_ns = int(seconds * 1e9)
+    s = Span(name, _current_span.get(), _current_trace.get(), attrs, start_ns=time.perf_counter_ns() - duration_ns)
+    s.duration_ns = duration_ns
+    _finish(s)
+
+
+def current_trace_id():
+    # Correlation id for log lines: the request's trace, or the span chain a background task is in
+    trace = _current_trace.get()
+    if trace is not None:
+        return trace.id
+    s = _current_span.get()
+    return s.trace_id if s else None
+
+
+def start_trace():
+    # Called at the start of a request; spans opened below it in this task (and tasks it spawns) join it
+    trace = Trace(sampled=random.random() < TRACE_SAMPLE_RATE)
+    _current_trace.set(trace)
+    return trace
+
+
+if __name__ == "__main__":
+    import sys
+    path = sys.argv[1] if len(sys.argv) > 1 else TRACE_FILE
+    with open(path, "r", encoding="utf-8") as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, sys.stdout)